@@ -36,9 +36,17 @@ class STA_IF(AbstractNetwork):
         # Cache the argument to 'successful' connect call (if the network was in scan_results)
         self.DEBUG_CONNECTED_SSID = None
         self.DEBUG_CONNECTED_BSSID = None
+        # Map of SSID -> STAT_* code for networks whose connect attempts should fail
+        self.DEBUG_REJECT = {}
+        self.status_code = STAT_IDLE
+        self.DEBUG_RSSI = -60
 
     #def connect(self, ssid, key=None, **kwargs):
     def connect(self, ssid, key=None, *, bssid):
+        if ssid in self.DEBUG_REJECT:
+            self.connected = False
+            self.status_code = self.DEBUG_REJECT[ssid]
+            return
         for network in self.scan_results:
             should_connect = network[0].decode('utf-8') == ssid and \
                 (bssid is None or bssid == network[1])
@@ -48,6 +56,7 @@ class STA_IF(AbstractNetwork):
                 self.DEBUG_CONNECTED_BSSID = bssid
                 return
         self.connected = False
+        self.status_code = STAT_NO_AP_FOUND
 
     def scan(self):
         return self.scan_results
@@ -55,12 +64,14 @@ class STA_IF(AbstractNetwork):
     def isconnected(self):
         return self.connected
 
-    def status(self):
+    def status(self, param=None):
         # "STAT_IDLE" "STAT_CONNECTING" "STAT_WRONG_PASSWORD" "STAT_NO_AP_FOUND" "STAT_CONNECT_FAIL" "STAT_GOT_IP"
+        if param == 'rssi':
+            return self.DEBUG_RSSI
         if self.connected:
             return STAT_GOT_IP
         else:
-            return STAT_IDLE
+            return self.status_code
 
 
 # The adhoc access point master
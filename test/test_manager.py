@@ -1,4 +1,8 @@
+import binascii
+import json
+import os
 import sys
+import time
 
 import unittest
 import uasyncio as asyncio
@@ -13,12 +17,33 @@ sys.modules['logging'] = logging
 
 # Important - do hackery before importing me
 from wifi_manager import WifiManager
+from wifi_manager import config_server
+
+WifiManager.state_file = 'test/_tmp_state.json'
+
+
+def reset_manager_state():
+    try:
+        os.remove(WifiManager.state_file)
+    except OSError:
+        pass
+    WifiManager._last_good = None
+    WifiManager._last_good_loaded = False
+    WifiManager.invalidate_scan_cache()
+
 
 class LogicTests(unittest.TestCase):
 
+    def setUp(self):
+        reset_manager_state()
+
+    def tearDown(self):
+        reset_manager_state()
+
     # Choose BSSID for a network among a list of unique SSID
     def test_fallback_choose_single(self):
         network.DEBUG_RESET()
+        WifiManager.reset_interfaces()
         interface = network.WLAN(network.STA_IF)
         host = network.WLAN(network.AP_IF)
         interface.scan_results = sample_scans.scan1()
@@ -34,6 +59,7 @@ class LogicTests(unittest.TestCase):
     # Choose BSSID for a network among a list with multiple instances of the SSID
     def test_fallback_choose_best(self):
         network.DEBUG_RESET()
+        WifiManager.reset_interfaces()
         interface = network.WLAN(network.STA_IF)
         host = network.WLAN(network.AP_IF)
         interface.scan_results = sample_scans.scan2()
@@ -49,6 +75,7 @@ class LogicTests(unittest.TestCase):
     # No known networks found and fallback AP policy so should have just the AP started
     def test_fallback_ap(self):
         network.DEBUG_RESET()
+        WifiManager.reset_interfaces()
         interface = network.WLAN(network.STA_IF)
         host = network.WLAN(network.AP_IF)
         interface.scan_results = sample_scans.scan3()
@@ -65,6 +92,7 @@ class LogicTests(unittest.TestCase):
     # Should have both managed access and AP started as AP always policy and known networks joined
     def test_always_ap(self):
         network.DEBUG_RESET()
+        WifiManager.reset_interfaces()
         interface = network.WLAN(network.STA_IF)
         host = network.WLAN(network.AP_IF)
         interface.scan_results = sample_scans.scan1()
@@ -81,6 +109,7 @@ class LogicTests(unittest.TestCase):
     # Should connect to nothing as no known networks and no AP policy
     def test_never_ap(self):
         network.DEBUG_RESET()
+        WifiManager.reset_interfaces()
         interface = network.WLAN(network.STA_IF)
         host = network.WLAN(network.AP_IF)
         interface.scan_results = sample_scans.scan1()
@@ -94,10 +123,279 @@ class LogicTests(unittest.TestCase):
         self.assertTrue(host.active())
         self.assertTrue(host.config_dict['essid'] == "Micropython-Dev")
 
+    # Interfaces are created once and only re-fetched after reset_interfaces()
+    def test_interfaces_cached(self):
+        network.DEBUG_RESET()
+        WifiManager.reset_interfaces()
+        sta = WifiManager.wlan()
+        network.DEBUG_RESET()
+        self.assertTrue(WifiManager.wlan() is sta)
+        WifiManager.reset_interfaces()
+        self.assertTrue(WifiManager.wlan() is network.WLAN(network.STA_IF))
+        self.assertFalse(WifiManager.wlan() is sta)
+
+
+class ConfigCacheTests(unittest.TestCase):
+
+    config_path = 'test/_tmp_networks.json'
+
+    def setUp(self):
+        reset_manager_state()
+        network.DEBUG_RESET()
+        WifiManager.reset_interfaces()
+        with open('test/networks_fallback.json') as src, open(self.config_path, 'w') as dst:
+            dst.write(src.read())
+        WifiManager.config_file = self.config_path
+        WifiManager.invalidate_config_cache()
+        WifiManager.config_cache_hits = 0
+        WifiManager.config_cache_misses = 0
+
+    def tearDown(self):
+        for path in (self.config_path, self.config_path + '.bak', self.config_path + '.tmp'):
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+        reset_manager_state()
+
+    # Repeated setups should parse the file only once
+    def test_cache_hit(self):
+        interface = network.WLAN(network.STA_IF)
+        interface.scan_results = sample_scans.scan1()
+        WifiManager.setup_network()
+        WifiManager.setup_network()
+        self.assertEqual(WifiManager.config_cache_stats(), {"hits": 1, "misses": 1})
+
+    # A changed file (different size) must be re-parsed
+    def test_cache_invalidated_on_change(self):
+        first = WifiManager.load_config()
+        with open(self.config_path, 'w') as f:
+            f.write('{"known_networks": [], "access_point": {}, "schema": 2}')
+        second = WifiManager.load_config()
+        self.assertEqual(len(first["known_networks"]), 1)
+        self.assertEqual(second["known_networks"], [])
+        self.assertEqual(WifiManager.config_cache_misses, 2)
+
+    # Writes go through a temp file and keep the previous config as a backup
+    def test_atomic_write_keeps_backup(self):
+        with open(self.config_path) as f:
+            original = f.read()
+        WifiManager._write_config('{"known_networks": [], "access_point": {}}', {"known_networks": [], "access_point": {}})
+        self.assertFalse(os.path.exists(self.config_path + '.tmp'))
+        with open(self.config_path + '.bak') as f:
+            self.assertEqual(f.read(), original)
+        self.assertEqual(WifiManager.load_config()["known_networks"], [])
+        self.assertEqual(WifiManager.config_cache_misses, 0)
+
+    # A truncated primary config rolls back to the backup
+    def test_rollback_on_corrupt_config(self):
+        WifiManager._write_config('{"known_networks": [], "access_point": {}}', {"known_networks": [], "access_point": {}})
+        with open(self.config_path, 'w') as f:
+            f.write('{"known_networks": [')
+        config = WifiManager.load_config()
+        self.assertEqual(len(config["known_networks"]), 1)
+        with open(self.config_path) as f:
+            self.assertEqual(len(json.loads(f.read())["known_networks"]), 1)
+
+
+    # A POST is answered at once; the change is applied afterwards, and repeated POSTs coalesce
+    def test_deferred_apply(self):
+        password, grace = WifiManager._config_server_password, WifiManager._apply_grace_ms
+        WifiManager._config_server_password = None
+        WifiManager._apply_grace_ms = 0
+        try:
+            with open('test/networks_managed.json') as f:
+                body = f.read()
+            interface = network.WLAN(network.STA_IF)
+            interface.scan_results = sample_scans.scan1()
+            runs = []
+            original = WifiManager.__dict__['setup_network_async']
+            setup = WifiManager.setup_network_async
+            async def counting_setup():
+                runs.append(1)
+                return await setup()
+            WifiManager.setup_network_async = counting_setup
+            for _ in range(2):
+                response = WifiManager._handle_config_request("POST /config HTTP/1.1", body)
+                self.assertTrue(response.startswith("HTTP/1.1 202"))
+            self.assertEqual(runs, [])
+            status = WifiManager._handle_config_request("GET /status HTTP/1.1")
+            self.assertEqual(json.loads(status.split("\r\n\r\n", 1)[1])["state"], "pending")
+            asyncio.get_event_loop().run_until_complete(asyncio.sleep(0.1))
+            self.assertEqual(runs, [1])
+            self.assertEqual(WifiManager._apply_status["state"], "done")
+        finally:
+            WifiManager.setup_network_async = original
+            WifiManager._config_server_password = password
+            WifiManager._apply_grace_ms = grace
+
+
+    # A background apply and manage()'s own pass never associate at the same time
+    def test_setup_passes_serialised(self):
+        network.WLAN(network.STA_IF).scan_results = sample_scans.scan1()
+        original = WifiManager.__dict__['connect_to_async']
+        connect = WifiManager.connect_to_async
+        active = []
+        overlaps = []
+        async def tracked_connect(**kwargs):
+            overlaps.append(len(active))
+            active.append(1)
+            await asyncio.sleep(0.01)
+            active.pop()
+            return await connect(**kwargs)
+        WifiManager.connect_to_async = tracked_connect
+        try:
+            async def both():
+                return await asyncio.gather(WifiManager.setup_network_async(), WifiManager.setup_network_async())
+            asyncio.get_event_loop().run_until_complete(both())
+        finally:
+            WifiManager.connect_to_async = original
+        self.assertEqual(len(overlaps), 2)
+        self.assertEqual(max(overlaps), 0)
+
+    # Without asyncio, a config change is applied before the response is returned
+    def test_apply_without_asyncio(self):
+        core = sys.modules[WifiManager.__module__]
+        saved, original = core.asyncio, WifiManager.__dict__['setup_network']
+        runs = []
+        WifiManager.setup_network = lambda: runs.append(1) or True
+        core.asyncio = None
+        try:
+            WifiManager._schedule_reconfigure()
+        finally:
+            core.asyncio = saved
+            WifiManager.setup_network = original
+        self.assertEqual(runs, [1])
+        self.assertEqual(WifiManager._apply_status, {"state": "done", "connected": True})
+
+
+    # Single entries can be added, edited, reordered and removed without posting the whole file
+    def test_incremental_edits(self):
+        password = WifiManager._config_server_password
+        original = WifiManager.__dict__['_schedule_reconfigure']
+        scheduled = []
+        WifiManager._config_server_password = None
+        WifiManager._schedule_reconfigure = lambda: scheduled.append(1)
+        def send(request, body=""):
+            return WifiManager._handle_config_request(request + " HTTP/1.1", body).split(" ", 2)[1]
+        try:
+            self.assertEqual(send("POST /networks", '{"ssid": "Cafe Wifi", "password": "x"}'), "202")
+            self.assertEqual(send("POST /networks", '{"ssid": "HomeNetwork", "password": ""}'), "409")
+            self.assertEqual(send("PUT /networks/Cafe%20Wifi", '{"password": "y"}'), "202")
+            self.assertEqual(send("PUT /networks/Nowhere", '{"password": "y"}'), "404")
+            self.assertEqual(send("POST /networks/order", '["HomeNetwork"]'), "400")
+            self.assertEqual(send("POST /networks/order", '["Cafe Wifi", "HomeNetwork"]'), "202")
+            self.assertEqual(send("PATCH /access_point", '{"config": {"channel": 6}}'), "202")
+            with open(self.config_path) as f:
+                config = json.loads(f.read())
+            self.assertEqual([n["ssid"] for n in config["known_networks"]], ["Cafe Wifi", "HomeNetwork"])
+            self.assertEqual(config["known_networks"][0]["password"], "y")
+            self.assertEqual(config["access_point"]["config"], {"channel": 6})
+            self.assertEqual(send("DELETE /networks/Cafe%20Wifi"), "202")
+            self.assertEqual(len(WifiManager.load_config()["known_networks"]), 1)
+            self.assertEqual(WifiManager.config_cache_misses, 1)
+            self.assertEqual(len(scheduled), 5)
+        finally:
+            WifiManager._schedule_reconfigure = original
+            WifiManager._config_server_password = password
+
+    # Entries the candidate builders cannot use are refused, so a bad edit cannot break setup
+    def test_edits_need_password(self):
+        password = WifiManager._config_server_password
+        original = WifiManager.__dict__['_schedule_reconfigure']
+        WifiManager._config_server_password = None
+        WifiManager._schedule_reconfigure = lambda: None
+        def send(request, body=""):
+            return WifiManager._handle_config_request(request + " HTTP/1.1", body).split(" ", 2)[1]
+        try:
+            self.assertEqual(send("POST /networks", '{"ssid": "Cafe Wifi"}'), "400")
+            self.assertEqual(send("POST /networks", '{"ssid": "Cafe Wifi", "password": 1234}'), "400")
+            self.assertEqual(send("POST /networks", '{"ssid": 7, "password": ""}'), "400")
+            self.assertEqual(send("PUT /networks/HomeNetwork", '{"password": null}'), "400")
+            self.assertEqual(send("POST /networks", '{"ssid": "Open Cafe", "password": ""}'), "202")
+            self.assertEqual([n["ssid"] for n in WifiManager.load_config()["known_networks"]],
+                             ["HomeNetwork", "Open Cafe"])
+        finally:
+            WifiManager._schedule_reconfigure = original
+            WifiManager._config_server_password = password
+
+
+    # Candidates follow edits straight away, without waiting for the file to be re-read
+    def test_edits_reach_candidates(self):
+        password = WifiManager._config_server_password
+        original = WifiManager.__dict__['_schedule_reconfigure']
+        WifiManager._config_server_password = None
+        WifiManager._schedule_reconfigure = lambda: None
+        try:
+            network.WLAN(network.STA_IF).scan_results = sample_scans.scan1()
+            WifiManager._load_network_config()
+            self.assertEqual([c["ssid"] for c in WifiManager._candidates()], ["HomeNetwork"])
+            WifiManager._handle_config_request("POST /networks HTTP/1.1", '{"ssid": "Skynet", "password": "x"}')
+            WifiManager._handle_config_request("DELETE /networks/HomeNetwork HTTP/1.1")
+            self.assertEqual([c["ssid"] for c in WifiManager._candidates()], ["Skynet"])
+        finally:
+            WifiManager._schedule_reconfigure = original
+            WifiManager._config_server_password = password
+
+
+class ConnectTimeoutTests(unittest.TestCase):
+
+    def setUp(self):
+        WifiManager._association_history = {}
+        WifiManager._timeout_streaks = {}
+        WifiManager._connect_timeout = WifiManager._connect_timeout_defaults
+
+    # Without history we keep the historical 5 s wait
+    def test_default_timeout(self):
+        self.assertEqual(WifiManager.connect_timeout_ms("HomeNetwork", b'\x01'), 5000)
+
+    # Fast networks are clamped to the floor, slow ones to the ceiling
+    def test_learned_timeout_clamped(self):
+        for elapsed in (120, 150, 180):
+            WifiManager._record_association("Fast", b'\x01', elapsed)
+        for elapsed in (9000, 14000, 30000):
+            WifiManager._record_association("Slow", b'\x02', elapsed)
+        self.assertEqual(WifiManager.connect_timeout_ms("Fast", b'\x01'), 1000)
+        self.assertEqual(WifiManager.connect_timeout_ms("Slow", b'\x02'), 15000)
+
+    # p95 plus margin, falling back to the SSID-wide history for an unseen BSSID
+    def test_learned_timeout_p95(self):
+        for elapsed in (2000, 2500, 3000, 2200):
+            WifiManager._record_association("Office", b'\x03', elapsed)
+        self.assertEqual(WifiManager.connect_timeout_ms("Office", b'\x03'), 3500)
+        self.assertEqual(WifiManager.connect_timeout_ms("Office", b'\x04'), 3500)
+
+    # Each timeout doubles the next wait; a success restores the learned wait without keeping the timeouts
+    def test_timeout_widens_next_attempt(self):
+        ticks_ms = sys.modules[WifiManager.__module__].ticks_ms
+        for elapsed in (1100, 1200, 1200):
+            WifiManager._record_association("Mesh", b'\x03', elapsed)
+        self.assertEqual(WifiManager.connect_timeout_ms("Mesh", b'\x03'), 1700)
+        network.DEBUG_RESET()
+        WifiManager.reset_interfaces()
+        WifiManager._connect_bssid = b'\x03'
+        for expected in (3400, 6800, 13600, 15000):
+            WifiManager._connect_started = ticks_ms() - 20000
+            self.assertFalse(WifiManager._poll_connect("Mesh", 0))
+            self.assertEqual(WifiManager._last_connect_failure, "timeout")
+            self.assertEqual(WifiManager.connect_timeout_ms("Mesh", b'\x03'), expected)
+        network.WLAN(network.STA_IF).connected = True
+        WifiManager._connect_started = ticks_ms() - 1200
+        self.assertTrue(WifiManager._poll_connect("Mesh", 0))
+        self.assertEqual(WifiManager.connect_timeout_ms("Mesh", b'\x03'), 1700)
+
+
 class AsyncTests(unittest.TestCase):
 
+    def setUp(self):
+        reset_manager_state()
+
+    def tearDown(self):
+        reset_manager_state()
+
     def testStart(self):
         network.DEBUG_RESET()
+        WifiManager.reset_interfaces()
         WifiManager.config_file = 'test/networks_fallback.json'
         WifiManager.start_managing()
         loop = asyncio.get_event_loop()
@@ -107,6 +405,727 @@ class AsyncTests(unittest.TestCase):
         loop.run_until_complete(tester())
         #loop.run_until_complete()
 
+    # The async setup path should pick the same network as the blocking one
+    def test_setup_network_async(self):
+        network.DEBUG_RESET()
+        WifiManager.reset_interfaces()
+        interface = network.WLAN(network.STA_IF)
+        interface.scan_results = sample_scans.scan2()
+        WifiManager.config_file = 'test/networks_fallback.json'
+        loop = asyncio.get_event_loop()
+        loop.run_until_complete(WifiManager.setup_network_async())
+        self.assertTrue(interface.isconnected())
+        self.assertTrue(interface.DEBUG_CONNECTED_BSSID == b'\x90r@\x1f\xf0\xe4')
+
+    # A terminal status should abort the wait early and be reported in connection_failed
+    def test_connect_aborts_on_wrong_password(self):
+        network.DEBUG_RESET()
+        WifiManager.reset_interfaces()
+        interface = network.WLAN(network.STA_IF)
+        interface.scan_results = sample_scans.scan1()
+        interface.DEBUG_REJECT = {"HomeNetwork": network.STAT_WRONG_PASSWORD}
+        WifiManager.config_file = 'test/networks_managed.json'
+        events = []
+        callback = lambda event, **kwargs: events.append((event, kwargs))
+        WifiManager.on_connection_change(callback)
+        try:
+            loop = asyncio.get_event_loop()
+            connected = loop.run_until_complete(
+                WifiManager.connect_to_async(ssid="HomeNetwork", password="x", bssid=None))
+            self.assertFalse(connected)
+            self.assertEqual(WifiManager._last_connect_failure, "wrong_password")
+            loop.run_until_complete(WifiManager.setup_network_async())
+        finally:
+            WifiManager.remove_connection_callback(callback)
+        failed = [kwargs for event, kwargs in events if event == "connection_failed"]
+        self.assertEqual(failed[0]["failures"], [{"ssid": "HomeNetwork", "reason": "wrong_password"}])
+
+    # The last good network is retried straight away, without scanning
+    def test_fast_reconnect_skips_scan(self):
+        network.DEBUG_RESET()
+        WifiManager.reset_interfaces()
+        interface = network.WLAN(network.STA_IF)
+        interface.scan_results = sample_scans.scan2()
+        WifiManager.config_file = 'test/networks_managed.json'
+        loop = asyncio.get_event_loop()
+        loop.run_until_complete(WifiManager.setup_network_async())
+        # Simulate a soft reset: state only survives in the state file
+        WifiManager._last_good = None
+        WifiManager._last_good_loaded = False
+        WifiManager.invalidate_scan_cache()
+        network.DEBUG_RESET()
+        WifiManager.reset_interfaces()
+        interface = network.WLAN(network.STA_IF)
+        interface.scan_results = sample_scans.scan2()
+        scans = []
+        interface.scan = lambda: scans.append(1) or interface.scan_results
+        loop.run_until_complete(WifiManager.setup_network_async())
+        self.assertTrue(interface.isconnected())
+        self.assertEqual(interface.DEBUG_CONNECTED_BSSID, b'\x90r@\x1f\xf0\xe4')
+        self.assertEqual(scans, [])
+        self.assertEqual(interface.config_dict.get('channel'), 11)
+
+    # The fast path gives way when bssid_preference ranks another BSSID above the last good one
+    def test_fast_reconnect_respects_bssid_preference(self):
+        WifiManager._last_good = {"ssid": "HomeNetwork", "bssid": b'\x90r@\x1f\xf0\xe4', "channel": 11}
+        WifiManager._last_good_loaded = True
+        networks = WifiManager.preferred_networks
+        try:
+            WifiManager.preferred_networks = [
+                {"ssid": "HomeNetwork", "password": "b", "bssid_preference": ["9027e45d22c5", "9072401ff0e4"]}]
+            self.assertIsNone(WifiManager._fast_reconnect_candidate())
+            WifiManager.preferred_networks = [
+                {"ssid": "HomeNetwork", "password": "b", "bssid_preference": ["9072401ff0e4", "9027e45d22c5"]}]
+            self.assertEqual(WifiManager._fast_reconnect_candidate()["bssid"], b'\x90r@\x1f\xf0\xe4')
+        finally:
+            WifiManager.preferred_networks = networks
+            reset_manager_state()
+
+
+    # Repeated fallback setups configure the AP, announce it and start WebREPL only once
+    def test_access_point_not_reapplied(self):
+        network.DEBUG_RESET()
+        WifiManager.reset_interfaces()
+        WifiManager.config_file = 'test/networks_managed.json'
+        ap = network.WLAN(network.AP_IF)
+        applied = []
+        ap.config = lambda **kwargs: applied.append(kwargs)
+        events = []
+        WifiManager._connection_callbacks = [lambda event, **kwargs: events.append(event)]
+        starts = webrepl.DEBUG_STARTS
+        try:
+            loop = asyncio.get_event_loop()
+            for attempt in range(3):
+                self.assertFalse(loop.run_until_complete(WifiManager.setup_network_async()))
+            self.assertTrue(ap.active())
+            self.assertEqual(len(applied), 1)
+            self.assertEqual(applied[0]["essid"], "Micropython-Dev")
+            self.assertEqual(events.count("ap_started"), 1)
+            self.assertEqual(webrepl.DEBUG_STARTS - starts, 1)
+        finally:
+            WifiManager._connection_callbacks = []
+
+
+    # WebREPL follows the fallback AP: started with it, stopped once a network without it connects
+    def test_webrepl_lifecycle(self):
+        network.DEBUG_RESET()
+        WifiManager.reset_interfaces()
+        WifiManager.config_file = 'test/networks_managed.json'
+        events = []
+        WifiManager._connection_callbacks = [lambda event, **kwargs: events.append(event)]
+        stops = webrepl.DEBUG_STOPS
+        try:
+            loop = asyncio.get_event_loop()
+            loop.run_until_complete(WifiManager.setup_network_async())
+            network.WLAN(network.STA_IF).scan_results = sample_scans.scan1()
+            WifiManager.invalidate_scan_cache()
+            self.assertTrue(loop.run_until_complete(WifiManager.setup_network_async()))
+            loop.run_until_complete(WifiManager.setup_network_async())
+            self.assertFalse(network.WLAN(network.AP_IF).active())
+            self.assertEqual([e for e in events if e.startswith("webrepl")], ["webrepl_started", "webrepl_stopped"])
+            self.assertEqual(webrepl.DEBUG_STOPS - stops, 1)
+        finally:
+            WifiManager._connection_callbacks = []
+
+
+class ScanTests(unittest.TestCase):
+
+    def setUp(self):
+        reset_manager_state()
+        network.DEBUG_RESET()
+        WifiManager.reset_interfaces()
+        self.interface = network.WLAN(network.STA_IF)
+        self.interface.scan_results = sample_scans.scan1()
+        self.scans = []
+        self.interface.scan = lambda: self.scans.append(1) or self.interface.scan_results
+
+    def tearDown(self):
+        reset_manager_state()
+
+    # Scans within the TTL are served from the cache
+    def test_scan_reused_within_ttl(self):
+        self.assertTrue(WifiManager.last_scan() is None)
+        first = WifiManager.scan()
+        second = WifiManager.scan()
+        self.assertTrue(first is second)
+        self.assertEqual(len(self.scans), 1)
+        self.assertTrue(WifiManager.last_scan(max_age_ms=1000) is first)
+
+    # Known SSIDs in preference order, each at every BSSID seen for it, strongest first
+    def test_candidates_ranked(self):
+        WifiManager.preferred_networks = [
+            {"ssid": "Skynet", "password": "a", "enables_webrepl": False},
+            {"ssid": "HomeNetwork", "password": "b", "enables_webrepl": True},
+        ]
+        self.interface.scan_results = sample_scans.scan2()
+        candidates = list(WifiManager._candidates())
+        self.assertEqual([c["ssid"] for c in candidates], ["Skynet", "HomeNetwork", "HomeNetwork"])
+        self.assertEqual(candidates[1]["bssid"], b'\x90r@\x1f\xf0\xe4')
+        self.assertEqual(candidates[2]["bssid"], b'\x90\'\xe4]"\xc5')
+        self.assertEqual(candidates[1]["channel"], 11)
+        self.assertEqual(candidates[1]["password"], "b")
+
+    # A pinned BSSID is the only one considered, even when weaker
+    def test_candidates_pinned_bssid(self):
+        WifiManager.preferred_networks = [
+            {"ssid": "HomeNetwork", "password": "b", "enables_webrepl": False, "bssid": "90:27:e4:5d:22:c5"},
+        ]
+        self.interface.scan_results = sample_scans.scan2()
+        candidates = list(WifiManager._candidates())
+        self.assertEqual([c["bssid"] for c in candidates], [b'\x90\'\xe4]"\xc5'])
+        self.interface.scan_results = sample_scans.scan1()
+        WifiManager.invalidate_scan_cache()
+        self.assertEqual(list(WifiManager._candidates()), [])
+
+    # bssid_preference ranks BSSIDs ahead of signal strength, the others remain as fallbacks
+    def test_candidates_preferred_bssid(self):
+        WifiManager.preferred_networks = [
+            {"ssid": "HomeNetwork", "password": "b", "enables_webrepl": False,
+             "bssid_preference": ["00:00:00:00:00:01", "9027e45d22c5"]},
+        ]
+        self.interface.scan_results = sample_scans.scan2()
+        candidates = list(WifiManager._candidates())
+        self.assertEqual([c["bssid"] for c in candidates], [b'\x90\'\xe4]"\xc5', b'\x90r@\x1f\xf0\xe4'])
+
+    # When the preferred BSSID refuses us, the next BSSID of the same SSID is tried
+    def test_preferred_bssid_falls_back(self):
+        config_path = 'test/_tmp_networks.json'
+        with open('test/networks_managed.json') as f:
+            config = json.loads(f.read())
+        config["known_networks"][0]["bssid_preference"] = ["9027e45d22c5"]
+        with open(config_path, 'w') as f:
+            f.write(json.dumps(config))
+        self.interface.scan_results = sample_scans.scan2()
+        connect = self.interface.connect
+        tried = []
+        def picky_connect(ssid, key=None, *, bssid):
+            tried.append(bssid)
+            if bssid == b'\x90\'\xe4]"\xc5':
+                self.interface.connected = False
+                self.interface.status_code = network.STAT_ASSOC_FAIL
+                return
+            connect(ssid, key, bssid=bssid)
+        self.interface.connect = picky_connect
+        WifiManager.config_file = config_path
+        WifiManager.invalidate_config_cache()
+        try:
+            self.assertTrue(asyncio.get_event_loop().run_until_complete(WifiManager.setup_network_async()))
+            self.assertEqual(tried, [b'\x90\'\xe4]"\xc5', b'\x90r@\x1f\xf0\xe4'])
+            self.assertEqual(self.interface.DEBUG_CONNECTED_BSSID, b'\x90r@\x1f\xf0\xe4')
+        finally:
+            WifiManager.invalidate_config_cache()
+            os.remove(config_path)
+
+    # A zero max age forces a rescan
+    def test_scan_refresh(self):
+        WifiManager.scan()
+        WifiManager.scan(max_age_ms=0)
+        self.assertEqual(len(self.scans), 2)
+
+    # Back-to-back setups share one scan
+    def test_setup_network_shares_scan(self):
+        WifiManager.config_file = 'test/networks_managed.json'
+        self.interface.DEBUG_REJECT = {"HomeNetwork": network.STAT_WRONG_PASSWORD}
+        loop = asyncio.get_event_loop()
+        loop.run_until_complete(WifiManager.setup_network_async())
+        loop.run_until_complete(WifiManager.setup_network_async())
+        self.assertEqual(len(self.scans), 1)
+
+
+class RoamingTests(unittest.TestCase):
+
+    def setUp(self):
+        reset_manager_state()
+        network.DEBUG_RESET()
+        WifiManager.reset_interfaces()
+        self.interface = network.WLAN(network.STA_IF)
+        self.interface.scan_results = sample_scans.scan2()
+        WifiManager.config_file = 'test/networks_managed.json'
+        WifiManager._roaming = dict(WifiManager._roaming_defaults, enabled=True, low_ticks=2)
+        WifiManager._current_connection = {"ssid": "HomeNetwork", "bssid": b'\x90\'\xe4]"\xc5', "channel": 6,
+                                           "password": "XYZ12345", "enables_webrepl": False}
+        WifiManager.preferred_networks = WifiManager.load_config()["known_networks"]
+        self.events = []
+        self.callback = lambda event, **kwargs: self.events.append((event, kwargs))
+        WifiManager.on_connection_change(self.callback)
+
+    def tearDown(self):
+        WifiManager.remove_connection_callback(self.callback)
+        WifiManager._roaming = WifiManager._roaming_defaults
+        WifiManager._current_connection = None
+        reset_manager_state()
+
+    # Roams after enough weak ticks when the gain beats the hysteresis
+    def test_roams_to_stronger_bssid(self):
+        self.interface.DEBUG_RSSI = -83
+        loop = asyncio.get_event_loop()
+        loop.run_until_complete(WifiManager._consider_roaming())
+        self.assertEqual(self.events, [])
+        loop.run_until_complete(WifiManager._consider_roaming())
+        self.assertEqual(self.interface.DEBUG_CONNECTED_BSSID, b'\x90r@\x1f\xf0\xe4')
+        self.assertEqual(self.events[0][0], "roamed")
+        self.assertEqual(self.events[0][1]["bssid"], "9072401ff0e4")
+
+    # A recent scan is reused instead of scanning again on the roaming check
+    def test_roaming_reuses_recent_scan(self):
+        scans = []
+        self.interface.scan = lambda: scans.append(1) or self.interface.scan_results
+        WifiManager.scan()
+        self.interface.DEBUG_RSSI = -83
+        loop = asyncio.get_event_loop()
+        for tick in range(2):
+            loop.run_until_complete(WifiManager._consider_roaming())
+        self.assertEqual(self.events[0][0], "roamed")
+        self.assertEqual(len(scans), 1)
+
+    # A failed roam rejoins the previous access point straight away
+    def test_failed_roam_rejoins_previous(self):
+        connect = self.interface.connect
+        tried = []
+        def picky_connect(ssid, key=None, *, bssid):
+            tried.append(bssid)
+            if bssid == b'\x90r@\x1f\xf0\xe4':
+                self.interface.connected = False
+                self.interface.status_code = network.STAT_ASSOC_FAIL
+                return
+            connect(ssid, key, bssid=bssid)
+        self.interface.connect = picky_connect
+        self.interface.DEBUG_RSSI = -83
+        loop = asyncio.get_event_loop()
+        for tick in range(2):
+            loop.run_until_complete(WifiManager._consider_roaming())
+        self.assertEqual(tried, [b'\x90r@\x1f\xf0\xe4', b'\x90\'\xe4]"\xc5'])
+        self.assertTrue(self.interface.isconnected())
+        self.assertEqual(self.interface.DEBUG_CONNECTED_BSSID, b'\x90\'\xe4]"\xc5')
+        self.assertEqual(self.events, [])
+        self.assertTrue(WifiManager.last_scan() is None)
+
+    # A healthy signal never triggers a roaming scan
+    def test_no_roaming_with_good_signal(self):
+        self.interface.DEBUG_RSSI = -60
+        loop = asyncio.get_event_loop()
+        for tick in range(3):
+            loop.run_until_complete(WifiManager._consider_roaming())
+        self.assertTrue(WifiManager.last_scan() is None)
+        self.assertEqual(self.events, [])
+
+
+class RetryTests(unittest.TestCase):
+
+    def setUp(self):
+        reset_manager_state()
+        WifiManager._retry_attempt = 0
+        WifiManager._retry = dict(WifiManager._retry_defaults, jitter=0)
+
+    def tearDown(self):
+        WifiManager._retry = WifiManager._retry_defaults
+        WifiManager._retry_attempt = 0
+        reset_manager_state()
+
+    # Fast retries first, then doubling up to the ceiling
+    def test_backoff_schedule(self):
+        WifiManager._retry["max_ms"] = 20000
+        delays = [WifiManager._next_retry_delay() for attempt in range(8)]
+        self.assertEqual(delays, [2000, 2000, 2000, 4000, 8000, 16000, 20000, 20000])
+
+    # Jitter stays within the configured spread
+    def test_backoff_jitter(self):
+        WifiManager._retry["jitter"] = 0.5
+        for attempt in range(3):
+            delay = WifiManager._next_retry_delay()
+            self.assertTrue(1000 <= delay <= 3000)
+
+    # A known SSID coming into range cuts the backoff short and resets it
+    def test_probe_resets_backoff(self):
+        network.DEBUG_RESET()
+        WifiManager.reset_interfaces()
+        interface = network.WLAN(network.STA_IF)
+        scans = [[], sample_scans.scan1()]
+        interface.scan = lambda: scans.pop(0) if len(scans) > 1 else scans[0]
+        WifiManager.preferred_networks = [{"ssid": "HomeNetwork", "password": "x", "enables_webrepl": False}]
+        WifiManager._retry["probe_ms"] = 5
+        WifiManager._retry_attempt = 6
+        ttl = WifiManager.scan_cache_ttl_ms
+        WifiManager.scan_cache_ttl_ms = 0
+        try:
+            loop = asyncio.get_event_loop()
+            started = time.time()
+            loop.run_until_complete(WifiManager._wait_for_retry(60000))
+            self.assertTrue(time.time() - started < 1)
+            self.assertEqual(WifiManager._retry_attempt, 0)
+        finally:
+            WifiManager.scan_cache_ttl_ms = ttl
+
+    # An AP that stays in range but keeps rejecting us does not reset the backoff
+    def test_probe_keeps_backoff_for_rejecting_ap(self):
+        network.DEBUG_RESET()
+        WifiManager.reset_interfaces()
+        interface = network.WLAN(network.STA_IF)
+        interface.scan_results = sample_scans.scan1()
+        WifiManager.preferred_networks = [{"ssid": "HomeNetwork", "password": "x", "enables_webrepl": False}]
+        WifiManager._retry["probe_ms"] = 5
+        ttl = WifiManager.scan_cache_ttl_ms
+        WifiManager.scan_cache_ttl_ms = 0
+        try:
+            loop = asyncio.get_event_loop()
+            delays = []
+            for attempt in range(6):
+                delays.append(WifiManager._next_retry_delay())
+                loop.run_until_complete(WifiManager._wait_for_retry(delays[-1] // 500))  # Scaled down
+            self.assertEqual(delays, [2000, 2000, 2000, 4000, 8000, 16000])
+            self.assertEqual(WifiManager._retry_attempt, 6)
+        finally:
+            WifiManager.scan_cache_ttl_ms = ttl
+
+    # The watcher reports a dropped link and wakes the connected sleep straight away
+    def test_watcher_wakes_manage(self):
+        network.DEBUG_RESET()
+        WifiManager.reset_interfaces()
+        events = []
+        interval = WifiManager.watch_interval_ms
+        WifiManager.watch_interval_ms = 5
+        WifiManager._connection_callbacks = [lambda event, **kwargs: events.append(event)]
+        WifiManager._last_connection_state = "connected"
+        WifiManager._link_lost = asyncio.Event()
+        loop = asyncio.get_event_loop()
+        watcher = loop.create_task(WifiManager._watch_link())
+        try:
+            started = time.time()
+            loop.run_until_complete(WifiManager._sleep_while_linked(60000))
+            self.assertTrue(time.time() - started < 1)
+            self.assertEqual(events, ["disconnected"])
+        finally:
+            watcher.cancel()
+            WifiManager.watch_interval_ms = interval
+            WifiManager._connection_callbacks = []
+            WifiManager._link_lost = None
+
+
+    # A board that came up connected, before any connect attempt, stays quiet
+    def test_watcher_when_already_connected(self):
+        network.DEBUG_RESET()
+        WifiManager.reset_interfaces()
+        network.WLAN(network.STA_IF).connected = True
+        WifiManager._terminal_statuses = None
+        events = []
+        interval = WifiManager.watch_interval_ms
+        WifiManager.watch_interval_ms = 5
+        WifiManager._connection_callbacks = [lambda event, **kwargs: events.append(event)]
+        WifiManager._last_connection_state = "connected"
+        WifiManager._link_lost = asyncio.Event()
+        WifiManager._notify_connection_change("ap_started", essid="x")
+        loop = asyncio.get_event_loop()
+        watcher = loop.create_task(WifiManager._watch_link())
+        warnings = []
+        warning = logging.getLogger("wifi_manager").warning
+        logging.getLogger("wifi_manager").warning = lambda *args: warnings.append(args)
+        try:
+            loop.run_until_complete(asyncio.sleep(0.05))
+        finally:
+            watcher.cancel()
+            del logging.getLogger("wifi_manager").warning
+            WifiManager.watch_interval_ms = interval
+            WifiManager._connection_callbacks = []
+            WifiManager._link_lost = None
+        self.assertEqual(warnings, [])
+        self.assertEqual(events, ["ap_started"])
+        self.assertEqual(WifiManager._last_connection_state, "connected")
+
+
+class DispatchTests(unittest.TestCase):
+
+    def setUp(self):
+        self.events = []
+        WifiManager._connection_callbacks = [self.record]
+        WifiManager._callback_stats = {}
+        WifiManager.dispatch_mode = "async"
+        WifiManager.events_dropped = 0
+
+    def tearDown(self):
+        asyncio.get_event_loop().run_until_complete(asyncio.sleep(0.01))  # Drain whatever is queued
+        WifiManager._connection_callbacks = []
+        WifiManager.dispatch_mode = "sync"
+        WifiManager.event_overflow = "drop_oldest"
+
+    def record(self, event, **kwargs):
+        self.events.append((event, kwargs.get("n")))
+
+    async def record_async(self, event, **kwargs):
+        await asyncio.sleep(0)
+        self.events.append(("async " + event, kwargs.get("n")))
+
+    # Events are queued without running callbacks; the dispatcher task awaits async callbacks too
+    def test_queued_dispatch(self):
+        WifiManager.on_connection_change(self.record_async)
+        WifiManager._notify_connection_change("disconnected", n=1)
+        self.assertEqual(self.events, [])
+        self.assertEqual(WifiManager._last_connection_state, "disconnected")
+        asyncio.get_event_loop().run_until_complete(asyncio.sleep(0.01))
+        self.assertEqual(self.events, [("disconnected", 1), ("async disconnected", 1)])
+        stats = WifiManager.callback_stats()
+        self.assertEqual(stats["record"]["calls"], 1)
+        self.assertEqual(stats["record_async"]["errors"], 0)
+
+    # A full queue drops its oldest event, or with coalesce replaces the newest of the same kind
+    def test_overflow_policies(self):
+        size = WifiManager.event_queue_size
+        for n in range(size + 1):
+            WifiManager._notify_connection_change("roamed", n=n)
+        asyncio.get_event_loop().run_until_complete(asyncio.sleep(0.01))
+        self.assertEqual([n for _, n in self.events], list(range(1, size + 1)))
+        self.assertEqual(WifiManager.events_dropped, 1)
+
+        self.events = []
+        WifiManager.event_overflow = "coalesce"
+        WifiManager._notify_connection_change("connected", n=0)
+        for n in range(1, size + 1):
+            WifiManager._notify_connection_change("roamed", n=n)
+        asyncio.get_event_loop().run_until_complete(asyncio.sleep(0.01))
+        self.assertEqual(self.events[0], ("connected", 0))
+        self.assertEqual(self.events[-1], ("roamed", size))
+        self.assertEqual(len(self.events), size)
+
+
+    # Without uasyncio, sync callbacks still run cleanly and are not counted as errors
+    def test_sync_dispatch_without_asyncio(self):
+        core = sys.modules[WifiManager.__module__]
+        saved = core.asyncio
+        WifiManager.dispatch_mode = "sync"
+        core.asyncio = None
+        try:
+            WifiManager._notify_connection_change("disconnected", n=1)
+        finally:
+            core.asyncio = saved
+        self.assertEqual(self.events, [("disconnected", 1)])
+        self.assertEqual(WifiManager.callback_stats()["record"]["errors"], 0)
+
+
+class FakeReader:
+    """Serves a canned request a few bytes at a time, like a slow client"""
+
+    def __init__(self, data, chunk=7):
+        self.data = data
+        self.chunk = chunk
+
+    async def read(self, size):
+        size = min(size, self.chunk)
+        data, self.data = self.data[:size], self.data[size:]
+        return data
+
+
+class FakeWriter:
+
+    def __init__(self):
+        self.sent = b""
+        self.closed = False
+
+    def write(self, data):
+        self.sent += data
+
+    async def drain(self):
+        pass
+
+    def close(self):
+        self.closed = True
+
+    async def wait_closed(self):
+        pass
+
+
+class HttpRequestTests(unittest.TestCase):
+
+    def read(self, data, chunk=7):
+        return asyncio.get_event_loop().run_until_complete(
+            config_server.read_request(WifiManager, FakeReader(data, chunk)))
+
+    # Headers and a body spread across many segments are reassembled
+    def test_read_chunked_request(self):
+        body = b'{"known_networks": [], "access_point": {}}' * 10
+        request, received = self.read(b"POST /config HTTP/1.1\r\nContent-Length: %d\r\n\r\n" % len(body) + body)
+        self.assertTrue(request.startswith("POST /config"))
+        self.assertEqual(bytes(received), body)
+
+    # Body bytes that arrive with the headers are kept
+    def test_read_body_with_headers(self):
+        request, received = self.read(b"POST /config HTTP/1.1\nContent-Length: 2\n\n{}", chunk=4096)
+        self.assertEqual(request, "POST /config HTTP/1.1\r\nContent-Length: 2")
+        self.assertEqual(bytes(received), b"{}")
+
+    # Endless headers are cut off at the limit rather than buffered
+    def test_reject_oversize_headers(self):
+        data = b"GET / HTTP/1.1\r\nX-Padding: " + b"a" * 10000
+        reader = FakeReader(data, 4096)
+        try:
+            asyncio.get_event_loop().run_until_complete(config_server.read_request(WifiManager, reader))
+            self.fail("oversize headers accepted")
+        except ValueError as e:
+            self.assertTrue(str(e).startswith("431"))
+        self.assertTrue(len(data) - len(reader.data) <= WifiManager._max_header_bytes)
+
+    # Headers that are not UTF-8 get a 400, not an unhandled error
+    def test_invalid_utf8_header(self):
+        writer = FakeWriter()
+        asyncio.get_event_loop().run_until_complete(
+            config_server.serve_client(WifiManager, FakeReader(b"GET / HTTP/1.1\r\nX: \xff\r\n\r\n"), writer))
+        self.assertTrue(writer.sent.startswith(b"HTTP/1.1 400 Bad Request\r\n"))
+
+    # Oversize bodies are refused before being read
+    def test_reject_oversize_body(self):
+        with self.assertRaises(ValueError):
+            self.read(b"POST /config HTTP/1.1\r\nContent-Length: 999999\r\n\r\n")
+
+    # A truncated body is an error rather than a partial config
+    def test_reject_truncated_body(self):
+        with self.assertRaises(ValueError):
+            self.read(b"POST /config HTTP/1.1\r\nContent-Length: 50\r\n\r\n{}")
+
+    # Clients over the limit are turned away straight away
+    def test_client_limit(self):
+        WifiManager._config_server_clients = WifiManager._config_server_max_clients
+        writer = FakeWriter()
+        try:
+            asyncio.get_event_loop().run_until_complete(
+                config_server.serve_client(WifiManager, FakeReader(b"GET / HTTP/1.1\r\n\r\n"), writer))
+        finally:
+            WifiManager._config_server_clients = 0
+        self.assertTrue(writer.sent.startswith(b"HTTP/1.1 503"))
+        self.assertTrue(writer.closed)
+
+    # A turned-away client has its request read first, so it gets the 503 rather than a reset
+    def test_busy_reads_request(self):
+        WifiManager._config_server_clients = WifiManager._config_server_max_clients
+        reader = FakeReader(b"GET / HTTP/1.1\r\n\r\n", 4096)
+        writer = FakeWriter()
+        try:
+            asyncio.get_event_loop().run_until_complete(config_server.serve_client(WifiManager, reader, writer))
+        finally:
+            WifiManager._config_server_clients = 0
+        self.assertEqual(reader.data, b"")
+        self.assertTrue(b"\r\nConnection: close\r\n" in writer.sent)
+
+    # A client too slow to send its request gets a 408 instead of a dropped connection
+    def test_request_timeout(self):
+        class StalledReader:
+            async def read(self, size):
+                await asyncio.sleep_ms(10000)
+        timeout = WifiManager._config_server_timeout
+        WifiManager._config_server_timeout = 0.05
+        writer = FakeWriter()
+        try:
+            asyncio.get_event_loop().run_until_complete(
+                config_server.serve_client(WifiManager, StalledReader(), writer))
+        finally:
+            WifiManager._config_server_timeout = timeout
+        self.assertTrue(writer.sent.startswith(b"HTTP/1.1 408 Request Timeout\r\n"))
+        self.assertTrue(writer.closed)
+        self.assertEqual(WifiManager._config_server_clients, 0)
+
+
+class ConfigPageTests(unittest.TestCase):
+
+    def setUp(self):
+        self.password = WifiManager._config_server_password
+        WifiManager._config_server_password = None
+
+    def tearDown(self):
+        WifiManager._config_server_password = self.password
+
+    # The server code is a separate submodule, found through the package
+    def test_server_module(self):
+        self.assertTrue(WifiManager._config_server_module() is config_server)
+        self.assertFalse(hasattr(WifiManager, "_config_html"))
+
+    # The precomputed gzip and ETag must match the page they were made from
+    def test_precomputed_page_matches(self):
+        import gzip
+        import binascii
+        self.assertEqual(gzip.decompress(config_server.HTML_GZ), config_server.HTML)
+        self.assertEqual(config_server.HTML_ETAG, '"%08x"' % (binascii.crc32(config_server.HTML) & 0xffffffff))
+
+    # Gzip is only sent to clients that accept it
+    def test_page_encoding(self):
+        headers, body = WifiManager._handle_config_request("GET / HTTP/1.1\r\nAccept-Encoding: gzip, deflate")
+        self.assertTrue("Content-Encoding: gzip" in headers)
+        self.assertTrue(body is config_server.HTML_GZ)
+        headers, body = WifiManager._handle_config_request("GET / HTTP/1.1")
+        self.assertFalse("Content-Encoding" in headers)
+        self.assertTrue("Content-Length: %d" % len(config_server.HTML) in headers)
+        self.assertTrue(body is config_server.HTML)
+
+    # The config file is streamed in buffer-sized chunks with its length and ETag
+    def test_config_streamed(self):
+        WifiManager.config_file = 'test/networks_managed.json'
+        with open(WifiManager.config_file, 'rb') as f:
+            expected = f.read()
+        headers, body = WifiManager._handle_config_request("GET /config HTTP/1.1")
+        self.assertTrue("Content-Length: %d" % len(expected) in headers)
+        writer = FakeWriter()
+        writes = []
+        write = writer.write
+        writer.write = lambda data: writes.append(len(data)) or write(bytes(data))
+        asyncio.get_event_loop().run_until_complete(config_server.send_response(WifiManager, writer, (headers, body)))
+        self.assertEqual(writer.sent, headers.encode() + expected)
+        self.assertTrue(max(writes[1:]) <= WifiManager._stream_buffer_size)
+        self.assertTrue(body.closed)
+
+        etag = config_server.request_header(headers, "etag:")
+        response = WifiManager._handle_config_request("GET /config HTTP/1.1\r\nIf-None-Match: " + etag)
+        self.assertTrue(response.startswith("HTTP/1.1 304"))
+
+    # The config file is closed even when the client goes away before the headers are sent
+    def test_config_closed_on_write_error(self):
+        WifiManager.config_file = 'test/networks_managed.json'
+        headers, body = WifiManager._handle_config_request("GET /config HTTP/1.1")
+        writer = FakeWriter()
+
+        async def drain():
+            raise OSError(104)
+        writer.drain = drain
+        with self.assertRaises(OSError):
+            asyncio.get_event_loop().run_until_complete(
+                config_server.send_response(WifiManager, writer, (headers, body)))
+        self.assertTrue(body.closed)
+
+    # A matching If-None-Match gets a bodyless 304
+    def test_page_not_modified(self):
+        response = WifiManager._handle_config_request(
+            "GET / HTTP/1.1\r\nIf-None-Match: " + config_server.HTML_ETAG)
+        self.assertTrue(response.startswith("HTTP/1.1 304"))
+
+
+    # /scan serves the cached rows at once; a refresh runs afterwards and shows up on the next request
+    def test_scan_endpoint(self):
+        reset_manager_state()
+        network.DEBUG_RESET()
+        WifiManager.reset_interfaces()
+        interface = network.WLAN(network.STA_IF)
+        interface.scan_results = sample_scans.scan1()
+        WifiManager.scan()
+        interface.scan_results = sample_scans.scan1()[:1]
+        response = WifiManager._handle_config_request("GET /scan?refresh=1 HTTP/1.1")
+        result = json.loads(response.split("\r\n\r\n", 1)[1])
+        self.assertTrue(result["refreshing"])
+        self.assertEqual(len(result["networks"]), len(sample_scans.scan1()))
+        first = sample_scans.scan1()[0]
+        self.assertEqual(result["networks"][0], {"ssid": first[0].decode(), "bssid": binascii.hexlify(first[1]).decode(),
+                                                 "channel": first[2], "rssi": first[3], "authmode": first[4]})
+        loop = asyncio.get_event_loop()
+        grace = WifiManager._scan_refresh_grace_ms
+        WifiManager._scan_refresh_grace_ms = 10
+        WifiManager._config_server_clients = 1  # The /scan response is still being sent
+        try:
+            loop.run_until_complete(asyncio.sleep(0.1))
+            self.assertTrue(json.loads(config_server.scan_json(WifiManager))["refreshing"])
+            WifiManager._config_server_clients = 0
+            loop.run_until_complete(asyncio.sleep(0.15))
+        finally:
+            WifiManager._config_server_clients = 0
+            WifiManager._scan_refresh_grace_ms = grace
+        result = json.loads(config_server.scan_json(WifiManager))
+        self.assertFalse(result["refreshing"])
+        self.assertEqual(len(result["networks"]), 1)
+        reset_manager_state()
+
 
 if __name__ == '__main__':
     unittest.main()
@@ -0,0 +1,13 @@
+# Stubbed webrepl, counting lifecycle calls
+DEBUG_STARTS = 0
+DEBUG_STOPS = 0
+
+
+def start(*args, **kwargs):
+    global DEBUG_STARTS
+    DEBUG_STARTS += 1
+
+
+def stop():
+    global DEBUG_STOPS
+    DEBUG_STOPS += 1
@@ -0,0 +1,79 @@
+"""Compare importing wifi_manager from source and from .mpy under the unix MicroPython port
+
+    python tools/build_mpy.py
+    python tools/bench_import.py [--micropython PATH] [--runs N]
+
+Each run starts a fresh interpreter that imports wifi_manager (against the stubs in test/)
+and reports:
+  - import_ms: time taken by the import
+  - alloc_kb: heap allocated during the import with the GC disabled, i.e. what must fit on
+    the device if nothing is collected; compiling from source dominates this
+  - resident_kb: heap still in use after a collection
+The same figures are given for importing config_server, which only happens when the config
+server is started. Absolute numbers from the unix port are not those of an ESP8266, but the
+source/.mpy ratio carries over.
+"""
+import argparse
+import os
+import subprocess
+import sys
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+VARIANTS = (("source", os.path.join(ROOT, "wifi_manager")), ("mpy", os.path.join(ROOT, "build", "mpy")))
+STUBS = os.path.join(ROOT, "test")
+
+# Runs inside MicroPython
+PROBE = """
+import sys, gc, time
+sys.path[:0] = [{path!r}, {stubs!r}]
+
+def measure(load):
+    gc.collect()
+    before = gc.mem_alloc()
+    gc.disable()
+    start = time.ticks_us()
+    load()
+    elapsed = time.ticks_diff(time.ticks_us(), start)
+    allocated = gc.mem_alloc() - before
+    gc.enable()
+    gc.collect()
+    print(elapsed, allocated, gc.mem_alloc() - before)
+
+measure(lambda: __import__("wifi_manager"))
+from wifi_manager import WifiManager
+measure(WifiManager._config_server_module)
+"""
+
+
+def run_probe(micropython, path, heapsize):
+    output = subprocess.run([micropython, "-X", "heapsize=" + heapsize, "-c", PROBE.format(path=path, stubs=STUBS)],
+                            cwd=ROOT, check=True, stdout=subprocess.PIPE, universal_newlines=True).stdout
+    return [[int(value) for value in line.split()] for line in output.strip().splitlines()[-2:]]
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--micropython", default="micropython", help="unix port executable")
+    parser.add_argument("--runs", type=int, default=5, help="fresh interpreters per variant")
+    parser.add_argument("--heapsize", default="4M", help="heap for the interpreter (the GC is off while importing)")
+    args = parser.parse_args(argv)
+
+    print("{:<8} {:<14} {:>10} {:>10} {:>12}".format("variant", "module", "import_ms", "alloc_kb", "resident_kb"))
+    for variant, path in VARIANTS:
+        if not os.path.isdir(path):
+            print("{:<8} missing {}, run tools/build_mpy.py first".format(variant, os.path.relpath(path, ROOT)))
+            continue
+        try:
+            runs = [run_probe(args.micropython, path, args.heapsize) for _ in range(args.runs)]
+        except FileNotFoundError:
+            sys.exit("{} not found; build the unix port or pass --micropython".format(args.micropython))
+        for index, module in enumerate(("wifi_manager", "config_server")):
+            # Best of the runs for time; allocation is deterministic
+            elapsed = min(run[index][0] for run in runs)
+            allocated, resident = runs[0][index][1:]
+            print("{:<8} {:<14} {:>10.2f} {:>10.1f} {:>12.1f}".format(
+                variant, module, elapsed / 1000, allocated / 1024, resident / 1024))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,52 @@
+"""Precompile the wifi_manager modules to .mpy bytecode with mpy-cross
+
+Compiling wifi_manager.py on the device needs more heap than an ESP8266 can spare, so copy
+the .mpy files instead of the sources. Or freeze them into the firmware with
+wifi_manager/manifest.py.
+
+    python tools/build_mpy.py [--mpy-cross PATH] [--out DIR] [-- extra mpy-cross args]
+
+The .mpy version must match the firmware: use the mpy-cross built from (or released with)
+the same MicroPython version. Extra arguments such as -O2 or -march=xtensa are passed through.
+"""
+import argparse
+import os
+import subprocess
+import sys
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+SOURCE_DIR = os.path.join(ROOT, "wifi_manager")
+MODULES = ("wifi_manager.py", "config_server.py")
+
+
+def build(mpy_cross="mpy-cross", out=os.path.join(ROOT, "build", "mpy"), extra=()):
+    """Compile MODULES into `out`, returning the list of .mpy paths"""
+    os.makedirs(out, exist_ok=True)
+    built = []
+    for name in MODULES:
+        target = os.path.join(out, name[:-3] + ".mpy")
+        # -s records just the file name, so tracebacks do not carry the build machine's paths
+        command = [mpy_cross, "-o", target, "-s", name] + list(extra) + [name]
+        subprocess.run(command, cwd=SOURCE_DIR, check=True)
+        built.append(target)
+    return built
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--mpy-cross", default="mpy-cross", help="mpy-cross executable")
+    parser.add_argument("--out", default=os.path.join(ROOT, "build", "mpy"), help="output directory")
+    parser.add_argument("extra", nargs="*", help="arguments passed on to mpy-cross")
+    args = parser.parse_args(argv)
+    try:
+        built = build(args.mpy_cross, args.out, args.extra)
+    except FileNotFoundError:
+        sys.exit("{} not found; install it (pip install mpy-cross) or pass --mpy-cross".format(args.mpy_cross))
+    except subprocess.CalledProcessError as e:
+        sys.exit("mpy-cross failed with exit code {}".format(e.returncode))
+    for path in built:
+        print("{:>7} {}".format(os.path.getsize(path), os.path.relpath(path, ROOT)))
+
+
+if __name__ == "__main__":
+    main()
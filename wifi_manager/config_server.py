@@ -0,0 +1,603 @@
+"""Configuration web server for WifiManager
+
+Imported by WifiManager.start_config_server() on first use, so devices that never enable the
+server do not load the page or the HTTP handling. Functions take the WifiManager class, which
+keeps the server's settings and state.
+"""
+import json
+import os
+try:
+    from .wifi_manager import asyncio, binascii, log, ticks_diff, ticks_ms
+except ImportError:  # Installed as flat modules
+    from wifi_manager import asyncio, binascii, log, ticks_diff, ticks_ms
+
+# Minimal HTML for config interface, pre-encoded so serving it never builds a str
+HTML = b"""<!DOCTYPE html>
+<html><head><title>WiFi Manager Config</title>
+<style>body{font-family:Arial,sans-serif;margin:20px;}textarea{width:100%;}</style>
+</head><body>
+<h2>WiFi Manager Configuration</h2>
+<textarea id="config" rows="25" placeholder="Loading configuration..."></textarea><br><br>
+<button onclick="loadConfig()">Reload Config</button>
+<button onclick="saveConfig()">Save & Apply</button>
+<button onclick="testConfig()">Validate JSON</button><br><br>
+<div id="status"></div>
+
+<script>
+function setStatus(msg, isError) {
+    const status = document.getElementById('status');
+    status.innerHTML = msg;
+    status.style.color = isError ? 'red' : 'green';
+}
+
+function loadConfig() {
+    fetch('/config')
+        .then(response => response.text())
+        .then(data => {
+            try {
+                const formatted = JSON.stringify(JSON.parse(data), null, 2);
+                document.getElementById('config').value = formatted;
+                setStatus('Configuration loaded successfully');
+            } catch(e) {
+                document.getElementById('config').value = data;
+                setStatus('Loaded raw config (JSON parse failed)', true);
+            }
+        })
+        .catch(e => setStatus('Failed to load config: ' + e, true));
+}
+
+function testConfig() {
+    try {
+        const config = document.getElementById('config').value;
+        const parsed = JSON.parse(config);
+        if (!parsed.known_networks || !parsed.access_point) {
+            throw new Error('Missing required sections');
+        }
+        setStatus('JSON is valid!');
+    } catch(e) {
+        setStatus('JSON Error: ' + e.message, true);
+    }
+}
+
+function saveConfig() {
+    const configText = document.getElementById('config').value;
+    try {
+        JSON.parse(configText); // Validate first
+    } catch(e) {
+        setStatus('Cannot save: Invalid JSON - ' + e.message, true);
+        return;
+    }
+    
+    fetch('/config', {
+        method: 'POST',
+        headers: {'Content-Type': 'application/json'},
+        body: configText
+    })
+    .then(response => response.text())
+    .then(data => {
+        setStatus('Configuration saved! Device will reconnect with new settings...');
+        setTimeout(loadConfig, 3000); // Reload after reconnection
+    })
+    .catch(e => setStatus('Save failed: ' + e, true));
+}
+
+// Load config on page load
+loadConfig();
+</script>
+</body></html>"""
+# HTML gzipped (level 9, mtime 0) and its CRC32 ETag, precomputed so the device never
+# compresses or hashes it. Regenerate both whenever the page above changes (the tests check this).
+HTML_GZ = (
+    b'\x1f\x8b\x08\x00\x00\x00\x00\x00\x02\x03\x95Vmo\xdb6\x10\xfe\xae_q1\xb0I\xc2\x1c\xd9\xf3\xb0/~\x1b'
+    b'\xba4E;$K\xb1\x18\x1b\xf6\xa9`\xa5\x93\xcdE&=\xf2d\xd7p\xfd\xdfw\xa4dKv\x9d \x13\xe0\x17R\xf7\xf6<w'
+    b'\xbc\xe3\xf8\xea\xed\xc3\xcd\xec\xef\x8f\xb7\xb0\xa0e1\x0d\xc6\xfeg\xbc@\x91M\xc7$\xa9\xc0\xe9_\xf2'
+    b'\x9d\x84{\xa1\xc4\x1c\x0d\xdch\x95\xcb\xf9\xb8W\xbd\x0a\xc6\x96\xb6\xfc\xfbYg\xdb]\xae\x15]\xe7b)'
+    b'\x8b\xed\xf0\x8d\x91\xa2\xe8Z\xa1\xec\xb5E#\xf3\xd1R\x98\xb9T\xc3A\x7f\xf5e\xb4\x27\xfcB\xc2\xa0\xd8'
+    b'mdF\x8b\xe1\x8f\xfd\xfew\xa3\xfd\xb8W\xd9\x0a\xc6\xbd\xca\xbb3\xea\x02\x1a\x5c\x8a\xa04\x82\xa4V,;`'
+    b'\x99\x83A\x90\xd9\xa4\x93z\x81\x0e\x18\xbd\xb1\x93\xce\xe0\xe7\x0e\xac\x0a\x91\xe2B\x17\x19\x9aI\xe7'
+    b'N\x8bL\xaa9\xa4m;I\x92t\xa6\x8c\xaa\xb6\xc3\xce\x8d\xff\x04\xe3\xcf%\x91V\xa0UZ\xc8\xf4i\xd2)X\xbd'
+    b'\x0a!\x8a;\xd3?\xd0\xad\x8f\xacT\xc2\x17\xb4\xacXc\xa3\xf5\xc8+\xf8\x1e\xde\xacV\xc5\xf6\x05%BK\x8d'
+    b'\xd2\x9f\xa2\x90\x99 \x84\xdf\x1e\x1f~?j5\x81fr\xed\xe1[\x12TZ\x87\x86w\xa6\x01\xa7(5rE\xd3 /U\xea'
+    b'\xb0\x82Ez\xf4B\xd1\xd2\xce\xbb \xed\xad1\xda\xc4\xb0\x0b\x80\x1f\xe6\xc5\x12TV`\x02\x99N\xcb%*J\xe6'
+    b'H\xb7\x05\xba\xbf\xbfn?dQXI\x84\xf1\xc8kU\xabD*\x85\xe6\xfd\xec\xfe\x8e5\xd9\xf8\xc9;\x9f\xde$\xd5'
+    b'\x856\xfc\xb6\xf6\x0a\xbf@h0\x0ba\x08\xe1\xdc \xaap\x14\xec\x83&\xd66\xddu\x809R\xba\x88\xc2^\x95'
+    b'\xc00\xf6\x9b\xeeIh\x81*2hW\x0c\x01a2\x85\xc3\xff\xc4%6\x8a\xcfE\x99N\xe1\xc4v\xc7}\xf7\x90\xd9\x9e'
+    b'\xed4\xb4\xe4\xda,\x05\x11f\x8c\xc0\xe5\x81A\x19.&\x99o#\xbf\x5c\x09c\xd1\xdb\x8d\xbb\xa0\xca\xa2'
+    b'\xe8\xc2\xa0f\xa8\xfd<K\xea\x01S\xb2\x16E\xc9\x10\x1a\x87\xdf\x1ai\xd2\x18\x9e\x9c\x09\xcf\x19Gh\xcb'
+    b'4Eks\x8eb\x1b\x9e\x05\xb1\x87T8\x161\xbe\x00\xf5\xf5\xd19\xa0/\x06vW\x85b\xc4\xa6>o\xe0y\x02\xcf\x13'
+    b'\xe4B\x16\x98\xc5a\x979/\xf1<\xc4\xe3j\xdf\xca[\x1d\xb6\xcbZ\xcb\xcd;o\x08H{\xec\xb5+\xae(\xf8\x01'
+    b'\xb06\x1e\x9f\xd6U\xfbl\xd5\x14\x9c\xe6\xbd\xcaw\x1d\xf4\xe4\xb5\x9c\x8c\xce\xf4=\xcec\xb1T\xd5Qi'
+    b'\xb4\xd0\xca\x1c\xa2\xabJ2yRz\xa3>)\xa4\x8d6O\x16\xbe~\x85\xc3\x1b\xe1\xb3\xf9i\xa5\xa5\xa2\xf3\xac'
+    b'\xd1\x82\x9b\x1d(\xdc\x80?TQx/\xaduM\xce\xe0\xbf\xa54\xae\x18\xd0\xe3\xb6\xedBh\x18nQ\xe9\xd3#-\xac]'
+    b'\xbb\xb9:\x88_\xac\x97s-\xef\xbbf=Yr\xb0\xdc\xafOR\xbb?IA\xbb\x27\x9e\xf4\x9e\x8a\xa0\x19\x1f\xd9'
+    b'\xffK\xfci\x0a\xbf\xe1\xdc\x99\x8cG\xd0\xeb\xc1\xb1\x99\xe6\xd2Xz\x15\xc4\x1b\xa1\x94&\x1f\xf5\x10>('
+    b'\xcf\x8fw\x01\xd7/@v\x8fA*\x8d:P\xe0\xbe/\xf5\xb1n\xcb\xed\x12i\xa13\xa6\xf2\xe3\xc3\xe3,\xec\x1e'
+    b'\xf7\xdd`Dc\x87\xb0sG\x9e\x98\x8b\xeb\xd9v\x85!K\x0a\x1e&2\xf5\x0d\xa0\xf7\x8f\xd5*\xdc7jn\x92\x0e['
+    b'\xb4\x06\xadS\xf5\xca\xa6\xf9\x5c\xc3|\xb6\x099\x9e\xb2+x\x8bk\x99"ldQ\xb0a\x0eAq!\xf2\x92\x16\xbe'
+    b'\x5cY\x9d\xb8N-\xcf\xdfve\xf2\xf6L.Q\x97\x145\x03\xa0\x0b?\xf5\xfb\xfd*\x7f\xf5\xdc\x159\xf1\x8d\xe0'
+    b'h\x97\xfd\x9e@\xbb\xdc,\xfc\xf4\xadZ\xcf\xa5\x16\xc1\xd6\xef\x9a&\xc2\xd3\x98\x0f\xf1\x1c}c\x09\xda'
+    b'\xd3h\xc4\x17\x95\xc3h\xe5q\xec.+|\x1bq\xb7\xa7\xff\x00v\xa8V\x92T\x09\x00\x00')
+HTML_ETAG = '"9256a876"'
+
+
+async def run(manager):
+    """Run the configuration web server; each connection is served by its own task"""
+    try:
+        manager._config_server = await asyncio.start_server(lambda reader, writer: serve_client(manager, reader, writer),
+                                                   "0.0.0.0", manager.config_server_port,
+                                                   backlog=manager._config_server_max_clients)
+        log.info("Config server started on port {}".format(manager.config_server_port))
+    except Exception as e:
+        manager._config_server_enabled = False
+        log.error(f"Config server failed to start: {e}")
+
+
+async def serve_client(manager, reader, writer):
+    """Handle one connection, without ever blocking the event loop on a slow client"""
+    busy = manager._config_server_clients >= manager._config_server_max_clients
+    manager._config_server_clients += 1
+    try:
+        if busy:
+            await discard_request(manager, reader)
+            response = ("HTTP/1.1 503 Service Unavailable\r\nRetry-After: 1\r\nConnection: close\r\n"
+                        "Content-Type: text/plain\r\n\r\nBusy")
+        else:
+            try:
+                request, body = await asyncio.wait_for(read_request(manager, reader), manager._config_server_timeout)
+                response = handle_request(manager, request, body)
+            except asyncio.TimeoutError:
+                response = "HTTP/1.1 408 Request Timeout\r\nConnection: close\r\nContent-Type: text/plain\r\n\r\nTimeout"
+            except ValueError as e:
+                response = "HTTP/1.1 {0}\r\nContent-Type: text/plain\r\n\r\n{0}".format(e)
+            body = None  # Release the body buffer before sending the response
+        await send_response(manager, writer, response)
+    except Exception as e:
+        log.warning(f"Config server request error: {e}")
+    finally:
+        manager._config_server_clients -= 1
+        writer.close()
+        try:
+            await writer.wait_closed()
+        except Exception:
+            pass
+
+
+async def discard_request(manager, reader):
+    """Read and drop what a turned-away client has sent, briefly, so closing does not reset the connection"""
+    try:
+        await asyncio.wait_for(reader.read(manager._max_header_bytes), manager._config_server_busy_timeout)
+    except Exception:
+        pass  # Whatever is left unread, the client still gets its 503
+
+
+async def send_response(manager, writer, response):
+    """Write a response: a str, or a (headers, body) tuple whose parts may be str, bytes or an open file
+
+    Files are closed once the response is done, even if writing it fails part way.
+    """
+    parts = response if isinstance(response, tuple) else (response,)
+    try:
+        for part in parts:
+            if isinstance(part, (str, bytes)):
+                writer.write(part.encode() if isinstance(part, str) else part)
+                await writer.drain()
+            else:
+                await send_file(manager, writer, part)
+    finally:
+        for part in parts:
+            if not isinstance(part, (str, bytes)):
+                part.close()
+
+
+async def send_file(manager, writer, f):
+    """Stream an open file through one reusable buffer; send_response closes it"""
+    if manager._stream_buffer is None:
+        manager._stream_buffer = bytearray(manager._stream_buffer_size)
+    view = memoryview(manager._stream_buffer)
+    while True:
+        count = f.readinto(manager._stream_buffer)
+        if not count:
+            break
+        writer.write(view[:count])
+        await writer.drain()  # The buffer is reused, so it must be flushed first
+
+
+def check_basic_auth(manager, request):
+    """Check HTTP Basic Authentication"""
+    if not manager._config_server_password:
+        return True  # No password required
+
+    auth_header = None
+    for line in request.split('\r\n'):
+        if line.lower().startswith('authorization: basic '):
+            auth_header = line.split(' ', 2)[2]
+            break
+
+    if not auth_header:
+        return False
+
+    try:
+        # Decode base64 credentials
+        decoded = binascii.a2b_base64(auth_header).decode()
+        if ':' in decoded:
+            username, password = decoded.split(':', 1)
+            return username == "admin" and password == manager._config_server_password
+    except:
+        pass
+    return False
+
+
+def handle_request(manager, request: str, body=None):
+    """
+    Handle HTTP requests for the configuration web server.
+    `request` is the request line and headers; the body is either passed
+    separately (as read by read_request) or, if None, taken from `request`.
+    Returns the response as a str, or as a (headers, body) tuple where the body is bytes
+    or an open file for send_response to stream.
+    Supports:
+      - GET /config       → returns JSON config
+      - POST /config      → updates JSON config, applied in the background
+      - GET /status       → JSON progress of the last applied change
+      - GET /scan         → cached scan results as JSON; ?refresh=1 rescans in the background once
+                            the response is sent (the scan blocks the event loop while it runs)
+      - POST /networks, PUT|DELETE /networks/<ssid>, POST /networks/order,
+        PATCH /access_point → edit single entries (see edit_config)
+      - GET / or /index   → returns HTML editor
+    Requires Basic Auth username “admin” and password manager._config_server_password,
+    unless password is None or empty (in which case auth is skipped).
+    """
+    # 1) Authentication
+    if manager._config_server_password:
+        # look for “Authorization: Basic …”
+        auth = None
+        for line in request.split('\r\n'):
+            if line.lower().startswith("authorization: basic "):
+                auth = line.split(" ", 2)[2]
+                break
+        if not auth:
+            return (
+                "HTTP/1.1 401 Unauthorized\r\n"
+                "WWW-Authenticate: Basic realm=\"WiFi Config\"\r\n"
+                "Content-Type: text/plain\r\n"
+                "\r\n"
+                "Authentication required"
+            )
+        # decode and verify
+        try:
+            user_pass = binascii.a2b_base64(auth).decode()
+            user, pwd = user_pass.split(":", 1)
+            if user != "admin" or pwd != manager._config_server_password:
+                raise ValueError
+        except Exception:
+            return (
+                "HTTP/1.1 401 Unauthorized\r\n"
+                "WWW-Authenticate: Basic realm=\"WiFi Config\"\r\n"
+                "Content-Type: text/plain\r\n"
+                "\r\n"
+                "Invalid credentials"
+            )
+
+    # 2) POST /config → update config
+    if request.startswith("POST /config"):
+        # extract body
+        if body is None:
+            idx = request.find("\r\n\r\n")
+            if idx < 0:
+                return "HTTP/1.1 400 Bad Request\r\nContent-Type: text/plain\r\n\r\nNo request body"
+            body = request[idx+4:]
+        # parse JSON
+        try:
+            cfg = json.loads(body)
+            if "known_networks" not in cfg or "access_point" not in cfg:
+                raise ValueError("Missing required keys")
+        except ValueError as ve:
+            return (
+                "HTTP/1.1 400 Bad Request\r\n"
+                "Content-Type: text/plain\r\n"
+                f"\r\nInvalid JSON: {ve}"
+            )
+        except Exception as e:
+            return (
+                "HTTP/1.1 400 Bad Request\r\n"
+                "Content-Type: text/plain\r\n"
+                f"\r\nJSON parse error: {e}"
+            )
+        # write file
+        try:
+            manager._write_config(body, cfg)
+            log.info("Configuration updated via web interface")
+            manager._schedule_reconfigure()
+            return "HTTP/1.1 202 Accepted\r\nContent-Type: text/plain\r\n\r\nConfiguration saved, applying"
+        except Exception as e:
+            return (
+                "HTTP/1.1 500 Internal Server Error\r\n"
+                "Content-Type: text/plain\r\n"
+                f"\r\nFailed to save config: {e}"
+            )
+
+    method, path = (request.split(" ", 2) + ["", ""])[:2]
+    if path == "/networks" or path.startswith("/networks/") or path == "/access_point":
+        if body is None:
+            idx = request.find("\r\n\r\n")
+            body = request[idx+4:] if idx >= 0 else ""
+        status, message = edit_config(manager, method, path, body)
+        return "HTTP/1.1 {}\r\nContent-Type: text/plain\r\n\r\n{}".format(status, message)
+
+    if method == "GET" and path.split("?", 1)[0] == "/scan":
+        return ("HTTP/1.1 200 OK\r\nContent-Type: application/json\r\nCache-Control: no-cache\r\n\r\n"
+                + scan_json(manager, "refresh=1" in path))
+
+    if request.startswith("GET /status"):
+        status = dict(manager._apply_status)
+        wlan = manager.wlan()
+        status["connected"] = wlan.isconnected()
+        status["ip"] = wlan.ifconfig()[0] if status["connected"] else None
+        return ("HTTP/1.1 200 OK\r\nContent-Type: application/json\r\nCache-Control: no-cache\r\n\r\n"
+                + json.dumps(status))
+
+    # 3) GET /config → serve JSON
+    if request.startswith("GET /config"):
+        try:
+            stat = os.stat(manager.config_file)
+            etag = '"{:x}-{:x}"'.format(stat[6], stat[8])  # st_size, st_mtime
+            if request_header(request, "if-none-match:") == etag:
+                return "HTTP/1.1 304 Not Modified\r\nETag: {}\r\nCache-Control: no-cache\r\n\r\n".format(etag)
+            # The file itself is the body: send_response streams it through a small buffer
+            return (
+                "HTTP/1.1 200 OK\r\n"
+                "Content-Type: application/json\r\n"
+                "Content-Length: {}\r\n"
+                "ETag: {}\r\n"
+                "Cache-Control: no-cache\r\n"
+                "\r\n".format(stat[6], etag),
+                open(manager.config_file, "rb"))
+        except Exception as e:
+            return (
+                "HTTP/1.1 500 Internal Server Error\r\n"
+                "Content-Type: text/plain\r\n"
+                f"\r\nCould not read config: {e}"
+            )
+
+    # 4) GET / or /index → serve HTML editor
+    if request.startswith("GET / ") or "GET /index" in request:
+        return page_response(request)
+
+    # 5) anything else → 404
+    return (
+        "HTTP/1.1 404 Not Found\r\n"
+        "Content-Type: text/plain\r\n"
+        "\r\n"
+        "Not found"
+    )
+
+
+def edit_config(manager, method, path, body):
+    """Apply one small change to the parsed config and persist it, returning (status, message)
+
+      - POST /networks         {"ssid": ..., ...} appends a network
+      - PUT /networks/<ssid>   {...} merges keys into that network
+      - DELETE /networks/<ssid>
+      - POST /networks/order   ["ssid", ...] reorders the networks (all must be listed)
+      - PATCH /access_point    {...} merges keys, "config" one level deep
+    """
+    try:
+        data = json.loads(body) if body else None
+        config = manager.load_config()
+    except (OSError, ValueError) as e:
+        return "400 Bad Request", f"Invalid JSON: {e}"
+    networks = config.setdefault("known_networks", [])
+    ssids = [n.get("ssid") for n in networks]
+
+    # Validate everything first: the cached config is only modified once the change is known good
+    if path == "/networks" and method == "POST":
+        problem = network_problem(data)
+        if problem:
+            return "400 Bad Request", problem
+        if data["ssid"] in ssids:
+            return "409 Conflict", "Network already exists"
+        networks.append(data)
+    elif path == "/networks/order" and method == "POST":
+        if not isinstance(data, list) or len(data) != len(ssids) or not all(ssid in data for ssid in ssids):
+            return "400 Bad Request", "Order must list every known ssid once"
+        networks[:] = [networks[ssids.index(ssid)] for ssid in data]
+    elif path.startswith("/networks/") and method in ("PUT", "DELETE"):
+        ssid = unquote(path[len("/networks/"):])
+        if ssid not in ssids:
+            return "404 Not Found", "Unknown network"
+        if method == "DELETE":
+            networks.pop(ssids.index(ssid))
+        elif not isinstance(data, dict) or (data.get("ssid", ssid) != ssid and data["ssid"] in ssids):
+            return "400 Bad Request", "Expected an object with no conflicting ssid"
+        else:
+            entry = networks[ssids.index(ssid)]
+            merged = dict(entry)
+            merged.update(data)
+            problem = network_problem(merged)
+            if problem:
+                return "400 Bad Request", problem
+            entry.update(data)
+    elif path == "/access_point" and method == "PATCH":
+        if not isinstance(data, dict):
+            return "400 Bad Request", "Expected an object"
+        ap = config.setdefault("access_point", {})
+        for key, value in data.items():
+            if key == "config" and isinstance(value, dict):
+                ap.setdefault("config", {}).update(value)
+            else:
+                ap[key] = value
+    else:
+        return "405 Method Not Allowed", "Unsupported method for {}".format(path)
+
+    try:
+        manager._write_config(json.dumps(config), config)
+    except Exception as e:
+        manager.invalidate_config_cache()  # Forget the in-memory edit; the file is unchanged
+        return "500 Internal Server Error", f"Failed to save config: {e}"
+    log.info("Configuration {} {} via web interface".format(method, path))
+    manager._schedule_reconfigure()
+    return "202 Accepted", "Configuration saved, applying"
+
+
+def network_problem(entry):
+    """Why a known network entry cannot be used, or None; an empty password means an open network"""
+    if not isinstance(entry, dict) or not entry.get("ssid") or not isinstance(entry["ssid"], str):
+        return "A network needs an ssid"
+    if not isinstance(entry.get("password"), str):
+        return "A network needs a password (empty for an open network)"
+    return None
+
+
+def scan_json(manager, refresh=False):
+    """The cached scan as compact JSON, optionally starting a rescan that later requests will see"""
+    rows = manager.last_scan()
+    if (refresh or rows is None) and asyncio and not manager._scan_refreshing:
+        manager._scan_refreshing = True
+        asyncio.get_event_loop().create_task(refresh_scan(manager))
+    networks = []
+    for row in rows or ():
+        try:
+            ssid = row[0].decode()
+        except UnicodeError:
+            continue
+        networks.append({"ssid": ssid, "bssid": binascii.hexlify(row[1]).decode(),
+                         "channel": row[2], "rssi": row[3], "authmode": row[4]})
+    return json.dumps({
+        "age_ms": None if rows is None else ticks_diff(ticks_ms(), manager._scan_time),
+        "refreshing": manager._scan_refreshing,
+        "networks": networks,
+    })
+
+
+async def refresh_scan(manager):
+    """Rescan once the response that asked for it has been sent
+
+    wlan().scan() blocks: the event loop, and so every other task and client, stalls until it is
+    done. So wait until no client is being served (for at most the request timeout), then a
+    grace delay for the stack to flush the closed connection.
+    """
+    try:
+        waited_ms = 0
+        while manager._config_server_clients and waited_ms < manager._config_server_timeout * 1000:
+            await asyncio.sleep_ms(50)
+            waited_ms += 50
+        await asyncio.sleep_ms(manager._scan_refresh_grace_ms)
+        manager.scan(max_age_ms=0)
+    except Exception as e:
+        log.warning(f"Scan failed: {e}")
+    finally:
+        manager._scan_refreshing = False
+
+
+def unquote(text):
+    """Decode %XX escapes in a URL path segment"""
+    if "%" not in text:
+        return text
+    raw = text.encode()
+    out = bytearray()
+    i = 0
+    while i < len(raw):
+        if raw[i] == 0x25 and i + 3 <= len(raw):
+            try:
+                out.append(int(raw[i+1:i+3], 16))
+                i += 3
+                continue
+            except ValueError:
+                pass
+        out.append(raw[i])
+        i += 1
+    return out.decode()
+
+
+async def read_request(manager, reader):
+    """Read one HTTP request from a stream, returning (request line + headers as str, body bytearray)
+
+    Headers are read in chunks, never more than _max_header_bytes, up to the blank line; the
+    body is read in chunks straight into a buffer sized from Content-Length. Raises ValueError
+    carrying the HTTP status for requests we refuse, before reading any oversize body.
+    """
+    head = b""
+    while True:
+        end = header_end(head)
+        if end >= 0:
+            break
+        if len(head) >= manager._max_header_bytes:
+            raise ValueError("431 Request Header Fields Too Large")
+        chunk = await reader.read(min(manager._max_header_bytes - len(head), 256))
+        if not chunk:
+            raise ValueError("400 Bad Request")
+        head += chunk
+    try:
+        text = head[:end].decode()
+    except UnicodeError:
+        raise ValueError("400 Bad Request")
+    request = "\r\n".join(line.rstrip("\r") for line in text.split("\n") if line.rstrip("\r"))
+    text = None
+
+    length = content_length(request)
+    if length > manager._max_body_bytes:
+        raise ValueError("413 Payload Too Large")
+    body = bytearray(length)
+    view = memoryview(body)
+    # The last header chunk may already hold the start of the body
+    received = min(len(head) - end, length)
+    view[:received] = head[end:end + received]
+    head = None
+    readinto = getattr(reader, "readinto", None)
+    while received < length:
+        if readinto:
+            count = await readinto(view[received:])
+        else:
+            chunk = await reader.read(min(length - received, 512))
+            count = len(chunk)
+            view[received:received + count] = chunk
+        if not count:
+            raise ValueError("400 Bad Request")
+        received += count
+    return request, body
+
+
+def header_end(data) -> int:
+    """Index just past the blank line ending the headers in data, or -1 if not there yet"""
+    end = -1
+    for mark in (b"\n\r\n", b"\n\n"):
+        found = data.find(mark)
+        if found >= 0 and (end < 0 or found + len(mark) < end):
+            end = found + len(mark)
+    return end
+
+
+def request_header(request, name):
+    """Value of header `name` (lower case, with trailing colon) in the request, or None"""
+    for line in request.split("\r\n"):
+        if line.lower().startswith(name):
+            return line[len(name):].strip()
+    return None
+
+
+def content_length(request) -> int:
+    length = request_header(request, "content-length:")
+    if length is None:
+        return 0
+    try:
+        return int(length)
+    except ValueError:
+        raise ValueError("400 Bad Request")
+
+
+def page_response(request):
+    """The HTML editor as (headers, body), gzipped when the client accepts it, 304 when unchanged"""
+    etag = HTML_ETAG
+    if request_header(request, "if-none-match:") == etag:
+        return "HTTP/1.1 304 Not Modified\r\nETag: {}\r\nCache-Control: no-cache\r\n\r\n".format(etag)
+    gzipped = "gzip" in (request_header(request, "accept-encoding:") or "")
+    body = HTML_GZ if gzipped else HTML
+    return (
+        "HTTP/1.1 200 OK\r\n"
+        "Content-Type: text/html\r\n"
+        "{}"
+        "Content-Length: {}\r\n"
+        "ETag: {}\r\n"
+        "Cache-Control: no-cache\r\n"
+        "Vary: Accept-Encoding\r\n"
+        "\r\n".format("Content-Encoding: gzip\r\n" if gzipped else "", len(body), etag),
+        body)
@@ -0,0 +1,8 @@
+# Freeze WifiManager into a firmware image by adding
+#     include("path/to/micropython-wifimanager/wifi_manager/manifest.py")
+# to the board manifest. Frozen bytecode runs from flash: importing it compiles nothing
+# and uses only a little heap.
+metadata(description="A simple network configuration utility for MicroPython", version="1.0.2")
+
+module("wifi_manager.py")
+module("config_server.py")  # Only imported when the config server is started
@@ -14,7 +14,7 @@ except ImportError:
 setup(
   name = 'micropython-wifimanager',
   cmdclass={'sdist': sdist_upip.sdist} if sdist_upip else {},
-  py_modules = ['wifi_manager'],
+  py_modules = ['wifi_manager', 'config_server'],
   version = '1.0.2',
   description = 'A simple network configuration utility for MicroPython on the ESP-8266 and ESP-32 boards',
     long_description = open(os.path.join(os.path.dirname(os.path.abspath(__file__)), 'README.md')).read(),
@@ -5,11 +5,11 @@ Config is loaded from a file kept by default in '/networks.json'
 Priority of networks is determined implicitly by order in array, first being the highest.
 It will go through the list of preferred networks, connecting to the ones it detects present.
 
-Default behaviour is to always start the webrepl after setup,
-and only start the access point if we can't connect to a known access point ourselves.
+Default behaviour is to run the webrepl while the connected network or active access point
+enables it, and only start the access point if we can't connect to a known access point ourselves.
 
-Future scope is to use BSSID instead of SSID when micropython allows it,
-this would allow multiple access points with the same name, and we can select by signal strength.
+Where several access points share an SSID, the strongest is chosen, unless the known network
+pins an exact "bssid" or ranks them with a "bssid_preference" list.
 
 
 """
@@ -18,9 +18,25 @@ __version__ = "1.0.2"
 import json
 import time
 import os
+try:
+    from time import ticks_ms, ticks_diff
+except ImportError:  # CPython, e.g. host-side tests
+    def ticks_ms():
+        return int(time.time() * 1000)
+
+    def ticks_diff(end, start):
+        return end - start
 
 # Micropython modules
 import network
+try:
+    import ubinascii as binascii
+except ImportError:
+    import binascii
+try:
+    import urandom as random
+except ImportError:
+    import random
 try:
     import webrepl
 except ImportError:
@@ -28,7 +44,7 @@ except ImportError:
 try:
     import uasyncio as asyncio
 except ImportError:
-    pass
+    asyncio = None
 
 # Robust logger setup
 try:
@@ -60,113 +76,246 @@ class WifiManager:
     _config_server_password = "micropython"
     _connection_callbacks = []
     _last_connection_state = None
+    _max_header_bytes = 2048
+    _max_body_bytes = 8192
+    _config_server = None
+    _config_server_clients = 0
+    _config_server_max_clients = 2
+    _config_server_timeout = 5  # Seconds a client gets to send its request
+    _config_server_busy_timeout = 0.2  # Seconds spent reading a request we are too busy to serve
+    _scan_refresh_grace_ms = 200  # Delay between the last response going out and a GET /scan?refresh=1 rescan
+    config_server_port = 8080
+    _stream_buffer = None
+    _stream_buffer_size = 256
+    _server_module = None  # config_server, once start_config_server() has imported it
+    # Deferred re-setup after a config change, so the HTTP response goes out first
+    _apply_grace_ms = 1500
+    _apply_status = {"state": "idle"}
+    _apply_running = False
+    _apply_requested = False
+    _network_busy = None  # asyncio.Lock held by each setup or roaming pass, see _network_lock()
+
+    # Parsed config cache, keyed on the file's (path, size, mtime)
+    _config_cache = None
+    _config_cache_key = None
+    config_cache_hits = 0
+    config_cache_misses = 0
+
+    # wlan().status() codes that mean a connection attempt has definitively failed
+    _terminal_status_names = ("STAT_WRONG_PASSWORD", "STAT_NO_AP_FOUND", "STAT_HANDSHAKE_TIMEOUT",
+                              "STAT_CONNECT_FAIL", "STAT_ASSOC_FAIL", "STAT_BEACON_TIMEOUT")
+    _terminal_statuses = None  # Built lazily as not every port defines every constant
+    _last_connect_failure = None
+
+    # Connect timeout, learned per SSID/BSSID from recent successful association times.
+    # Overridable via the "connect_timeout" section of the config.
+    _connect_timeout_defaults = {"default_ms": 5000, "floor_ms": 1000, "ceiling_ms": 15000, "margin_ms": 500}
+    _connect_timeout = _connect_timeout_defaults
+    _connect_poll_ms = 100
+    _association_samples = 8
+    _association_history = {}  # (ssid, bssid) -> recent association times in ms, bssid None = any
+    _timeout_streaks = {}  # (ssid, bssid) -> consecutive timed-out attempts, each doubling the next wait
+    _connect_started = 0
+    _connect_deadline_ms = 0
+    _connect_bssid = None
+
+    # Last successfully joined network, persisted so we can reconnect without scanning after a reset
+    state_file = '/wifi_state.json'
+    _last_good = None
+    _last_good_loaded = False
+    _scan_failed = False
+
+    # Most recent wlan().scan() rows, shared by setup_network, the config server and applications.
+    # Overridable via the "scan_cache" section of the config.
+    scan_cache_ttl_ms = 5000
+    _scan_results = None
+    _scan_time = 0
+    _scan_refreshing = False  # A GET /scan?refresh=1 rescan is queued or running
+
+    # Known networks indexed by SSID bytes, so ranking is one pass over the scan
+    _known_source = None
+    _known_index = None
+    _known_order = None
+
+    # Opt-in roaming to a stronger BSSID of the same SSID, via the "roaming" section of the config
+    _roaming_defaults = {"enabled": False, "rssi_threshold": -75, "low_ticks": 3, "hysteresis_db": 8,
+                         "scan_max_age_ms": 30000}
+    _roaming = _roaming_defaults
+    _weak_signal_ticks = 0
+    _current_connection = None
+
+    # Reconnect scheduling for manage(), via the "retry" section of the config
+    _retry_defaults = {"connected_ms": 10000, "fast_ms": 2000, "fast_attempts": 3, "factor": 2,
+                       "max_ms": 300000, "jitter": 0.2, "probe_ms": 30000}
+    _retry = _retry_defaults
+    _retry_attempt = 0
+
+    # Link watcher started by start_managing(): checks the STA link this often ("watcher" section,
+    # 0 disables) and wakes manage() through _link_lost instead of waiting out connected_ms
+    watch_interval_ms = 1000
+    _link_lost = None
+
+    # network.WLAN objects, created on first use; see reset_interfaces()
+    _sta = None
+    _ap = None
+
+    # Interface state last applied by _finish_setup(), so unchanged setups leave the radio alone
+    _ap_applied_config = None
+    _webrepl_active = False
+    preferred_networks = []
+
+    # Events that report something happening without changing the connected/disconnected state
+    _informational_events = ("roamed", "ap_started", "webrepl_started", "webrepl_stopped")
+
+    # Callback dispatch: "sync" runs callbacks inline, "async" queues events for a background task
+    # so slow callbacks cannot delay reconnecting. When the queue is full, "drop_oldest" discards
+    # the oldest event and "coalesce" replaces the newest queued event of the same kind.
+    dispatch_mode = "sync"
+    event_queue_size = 8  # Read when the first event is queued
+    event_overflow = "drop_oldest"
+    events_dropped = 0
+    _event_queue = None
+    _event_head = 0
+    _event_count = 0
+    _event_signal = None
+    _callback_stats = {}
     
-    # Minimal HTML for config interface
-    _config_html = """<!DOCTYPE html>
-<html><head><title>WiFi Manager Config</title>
-<style>body{font-family:Arial,sans-serif;margin:20px;}textarea{width:100%;}</style>
-</head><body>
-<h2>WiFi Manager Configuration</h2>
-<textarea id="config" rows="25" placeholder="Loading configuration..."></textarea><br><br>
-<button onclick="loadConfig()">Reload Config</button>
-<button onclick="saveConfig()">Save & Apply</button>
-<button onclick="testConfig()">Validate JSON</button><br><br>
-<div id="status"></div>
-
-<script>
-function setStatus(msg, isError) {
-    const status = document.getElementById('status');
-    status.innerHTML = msg;
-    status.style.color = isError ? 'red' : 'green';
-}
-
-function loadConfig() {
-    fetch('/config')
-        .then(response => response.text())
-        .then(data => {
-            try {
-                const formatted = JSON.stringify(JSON.parse(data), null, 2);
-                document.getElementById('config').value = formatted;
-                setStatus('Configuration loaded successfully');
-            } catch(e) {
-                document.getElementById('config').value = data;
-                setStatus('Loaded raw config (JSON parse failed)', true);
-            }
-        })
-        .catch(e => setStatus('Failed to load config: ' + e, true));
-}
-
-function testConfig() {
-    try {
-        const config = document.getElementById('config').value;
-        const parsed = JSON.parse(config);
-        if (!parsed.known_networks || !parsed.access_point) {
-            throw new Error('Missing required sections');
-        }
-        setStatus('JSON is valid!');
-    } catch(e) {
-        setStatus('JSON Error: ' + e.message, true);
-    }
-}
-
-function saveConfig() {
-    const configText = document.getElementById('config').value;
-    try {
-        JSON.parse(configText); // Validate first
-    } catch(e) {
-        setStatus('Cannot save: Invalid JSON - ' + e.message, true);
-        return;
-    }
-    
-    fetch('/config', {
-        method: 'POST',
-        headers: {'Content-Type': 'application/json'},
-        body: configText
-    })
-    .then(response => response.text())
-    .then(data => {
-        setStatus('Configuration saved! Device will reconnect with new settings...');
-        setTimeout(loadConfig, 3000); // Reload after reconnection
-    })
-    .catch(e => setStatus('Save failed: ' + e, true));
-}
-
-// Load config on page load
-loadConfig();
-</script>
-</body></html>"""
 
     # Starts the managing call as a co-op async activity
     @classmethod
     def start_managing(cls):
         loop = asyncio.get_event_loop()
+        cls._link_lost = asyncio.Event()
         loop.create_task(cls.manage()) # Schedule ASAP
+        loop.create_task(cls._watch_link())
         # Make sure you loop.run_forever() (we are a guest here)
 
     # Checks the status and configures if needed
     @classmethod
     async def manage(cls):
         while True:
+            if cls._link_lost is not None:
+                cls._link_lost.clear()  # We are about to look at the link ourselves
             # Check for connection state changes and notify callbacks
             cls._check_and_notify_connection_state()
             
-            status = cls.wlan().status()
+            wlan = cls.wlan()
+            status = wlan.status()
             # ESP32 does not currently return
             if (status != network.STAT_GOT_IP) or \
-            (cls.wlan().ifconfig()[0] == '0.0.0.0'):  # temporary till #3967
+            (wlan.ifconfig()[0] == '0.0.0.0'):  # temporary till #3967
                 log.info("Network not connected: managing")
                 # Ignore connecting status for now.. ESP32 is a bit strange
                 # if status != network.STAT_CONNECTING: <- do not care yet
-                cls.setup_network()
-            await asyncio.sleep(10)  # Pause 10 seconds between checks
+                connected = await cls.setup_network_async()
+            else:
+                connected = True
+                await cls._consider_roaming()
+
+            if connected:
+                cls._retry_attempt = 0
+                await cls._sleep_while_linked(cls._retry["connected_ms"])
+            else:
+                await cls._wait_for_retry(cls._next_retry_delay())
+
+    @classmethod
+    async def _sleep_while_linked(cls, delay_ms):
+        """Sleep for delay_ms, returning early if the watcher sees the link drop"""
+        if cls._link_lost is None:
+            await asyncio.sleep_ms(delay_ms)
+            return
+        try:
+            await asyncio.wait_for(cls._link_lost.wait(), delay_ms / 1000)
+        except asyncio.TimeoutError:
+            pass
+
+    @classmethod
+    async def _watch_link(cls):
+        """Cheap poll of isconnected()/status(), so a dropped link is reported within watch_interval_ms"""
+        while True:
+            interval = cls.watch_interval_ms
+            await asyncio.sleep_ms(interval or cls._retry["connected_ms"])
+            if not interval or cls._last_connection_state != "connected":
+                continue  # Disabled, or manage() is already reconnecting
+            try:
+                wlan = cls.wlan()
+                if wlan.isconnected() and cls._connect_failure_reason(wlan.status()) is None:
+                    continue
+            except Exception as e:
+                log.warning(f"Link check failed: {e}")
+                continue
+            log.info("Link lost")
+            cls._notify_connection_change("disconnected")
+            cls._link_lost.set()
+
+    @classmethod
+    def _next_retry_delay(cls) -> int:
+        """Fast retries right after a disconnect, then exponential backoff with jitter up to max_ms"""
+        settings = cls._retry
+        attempt = cls._retry_attempt
+        cls._retry_attempt += 1
+        delay = settings["fast_ms"]
+        if attempt >= settings["fast_attempts"]:
+            exponent = min(attempt - settings["fast_attempts"] + 1, 20)  # Past the ceiling anyway
+            delay = min(int(delay * settings["factor"] ** exponent), settings["max_ms"])
+        spread = int(delay * settings["jitter"])
+        if spread:
+            delay += random.getrandbits(16) % (2 * spread + 1) - spread
+        return delay
+
+    @classmethod
+    async def _wait_for_retry(cls, delay_ms):
+        """Sleep until the next reconnect attempt, cutting a long backoff short once a known SSID comes into range
+
+        Known SSIDs already visible when the pass failed do not count (they just rejected us), so an AP
+        that stays in range but refuses the connection still gets the growing backoff.
+        """
+        probe_ms = cls._retry["probe_ms"]
+        if not probe_ms or delay_ms <= probe_ms:
+            await asyncio.sleep_ms(delay_ms)
+            return
+        seen = cls._visible_known_ssids()
+        while delay_ms > probe_ms:
+            await asyncio.sleep_ms(probe_ms)
+            delay_ms -= probe_ms
+            visible = cls._visible_known_ssids()
+            if visible is None:
+                continue
+            if seen is not None and visible - seen:
+                log.info("Known network in range, retrying now")
+                cls._retry_attempt = 0
+                return
+            seen = visible
+        await asyncio.sleep_ms(delay_ms)
+
+    @classmethod
+    def _visible_known_ssids(cls):
+        """Known SSIDs (bytes) in a scan, None if it fails; a scan only, setup_network reuses it via the cache"""
+        try:
+            return set(cls._best_rows(cls.scan()))
+        except OSError as e:
+            log.warning("Probe scan failed: {}".format(e))
+            return None
 
     @classmethod
     def wlan(cls):
-        return network.WLAN(network.STA_IF)
+        if cls._sta is None:
+            cls._sta = network.WLAN(network.STA_IF)
+        return cls._sta
 
     @classmethod
     def accesspoint(cls):
-        return network.WLAN(network.AP_IF)
+        if cls._ap is None:
+            cls._ap = network.WLAN(network.AP_IF)
+        return cls._ap
+
+    @classmethod
+    def reset_interfaces(cls):
+        """Forget the cached interfaces and what was applied to them, e.g. after a soft reset or in tests"""
+        cls._sta = None
+        cls._ap = None
+        cls._ap_applied_config = None
+        cls._webrepl_active = False
 
     @classmethod
     def wants_accesspoint(cls) -> bool:
@@ -177,23 +326,197 @@ loadConfig();
         return cls.wlan().status() != network.STAT_GOT_IP  # Discard intermediate states and check for not connected/ok
 
     @classmethod
-    def setup_network(cls) -> bool:
-        # now see our prioritised list of networks and find the first available network
+    def _config_stat_key(cls):
+        stat = os.stat(cls.config_file)
+        return (cls.config_file, stat[6], stat[8])  # st_size, st_mtime
+
+    @classmethod
+    def load_config(cls) -> dict:
+        """Return the parsed config, only re-reading the file when its size or mtime changed
+
+        If the file is missing or does not parse, the last good config is restored from the
+        backup kept by _write_config(). Raises OSError/ValueError when neither is usable.
+        """
         try:
+            key = cls._config_stat_key()
+            if cls._config_cache is not None and key == cls._config_cache_key:
+                cls.config_cache_hits += 1
+                return cls._config_cache
+            cls.config_cache_misses += 1
+            cls._config_cache = None  # Drop the stale copy before parsing so it can be collected
             with open(cls.config_file, "r") as f:
                 config = json.loads(f.read())
-                cls.preferred_networks = config['known_networks']
-                cls.ap_config = config["access_point"]
-                
-                # Check for config server settings
-                if "config_server" in config:
-                    server_config = config["config_server"]
-                    if server_config.get("enabled", False):
-                        password = server_config.get("password", "micropython")
-                        cls.start_config_server(password)
-                
-                if config.get("schema", 0) != 2:
-                    log.warning("Did not get expected schema [2] in JSON config.")
+        except (OSError, ValueError) as e:
+            config = cls._restore_config_backup(e)
+            if config is None:
+                raise e
+            return config
+        cls._config_cache = config
+        cls._config_cache_key = key
+        return config
+
+    @classmethod
+    def _restore_config_backup(cls, error):
+        backup = cls.config_file + ".bak"
+        try:
+            with open(backup, "r") as f:
+                data = f.read()
+            config = json.loads(data)
+            cls._write_file_atomic(cls.config_file, data)
+        except (OSError, ValueError):
+            return None
+        log.warning("Config {} unusable ({}), restored {}".format(cls.config_file, error, backup))
+        cls._store_config_cache(config)
+        return config
+
+    @classmethod
+    def _write_config(cls, data, config):
+        """Atomically replace the config file with `data` (already parsed as `config`), keeping a backup"""
+        cls._write_file_atomic(cls.config_file, data, backup=True)
+        cls._store_config_cache(config)
+
+    @staticmethod
+    def _write_file_atomic(path, data, backup=False):
+        """Write to a temp file, flush it to flash, then rename it over `path`
+
+        A reset part way through leaves either the old or the new file, never a truncated one.
+        With backup, the previous file is kept as `path`.bak.
+        """
+        temp = path + ".tmp"
+        with open(temp, "w" if isinstance(data, str) else "wb") as f:
+            f.write(data)
+            f.flush()
+            try:
+                os.fsync(f.fileno())  # CPython
+            except (AttributeError, OSError):
+                pass
+        try:
+            os.sync()  # MicroPython: flush all mounted filesystems
+        except AttributeError:
+            pass
+        if backup:
+            try:
+                os.rename(path, path + ".bak")
+            except OSError:
+                pass  # No previous file to keep
+        os.rename(temp, path)
+
+    @classmethod
+    def _store_config_cache(cls, config):
+        """Prime the cache with a config we have just written to disk"""
+        cls._known_source = None  # Config edits may change the known networks list in place
+        try:
+            cls._config_cache_key = cls._config_stat_key()
+            cls._config_cache = config
+        except OSError:
+            cls.invalidate_config_cache()
+
+    @classmethod
+    def invalidate_config_cache(cls):
+        cls._config_cache = None
+        cls._config_cache_key = None
+        cls._known_source = None
+
+    @classmethod
+    def config_cache_stats(cls) -> dict:
+        return {"hits": cls.config_cache_hits, "misses": cls.config_cache_misses}
+
+    @classmethod
+    def setup_network(cls) -> bool:
+        steps = cls._setup_steps()
+        step = next(steps)
+        while isinstance(step, dict):
+            # Micropython 1.9.3+ supports BSSID specification so let's use that
+            step = steps.send(cls.connect_to(ssid=step["ssid"], password=step["password"], bssid=step["bssid"]))
+        return step
+
+    @classmethod
+    async def setup_network_async(cls) -> bool:
+        """Same as setup_network(), but yields to the event loop while waiting on each candidate
+
+        Passes from manage(), a config change and roaming are serialised, so one never aborts
+        another's association.
+        """
+        async with cls._network_lock():
+            return await cls._setup_network_pass()
+
+    @classmethod
+    def _network_lock(cls):
+        if cls._network_busy is None:
+            cls._network_busy = asyncio.Lock()
+        return cls._network_busy
+
+    @classmethod
+    async def _setup_network_pass(cls) -> bool:
+        steps = cls._setup_steps()
+        step = next(steps)
+        while isinstance(step, dict):
+            step = steps.send(await cls.connect_to_async(ssid=step["ssid"], password=step["password"],
+                                                         bssid=step["bssid"]))
+        return step
+
+    @classmethod
+    def _setup_steps(cls):
+        """One setup pass, shared by setup_network and setup_network_async, which only differ in how they connect
+
+        Yields each candidate to connect to and must be sent whether that worked; the last value
+        yielded is the result of the pass.
+        """
+        if not cls._load_network_config():
+            yield False
+            return
+
+        connected = False
+        attempted = []
+        failures = []
+        for new_connection in cls._candidates():
+            log.info("Attempting to connect to network {0}...".format(new_connection["ssid"]))
+            attempted.append(new_connection["ssid"])
+            if (yield new_connection):
+                cls._on_connected(new_connection)
+                connected = True
+                break  # We are connected so don't try more
+            failures.append({"ssid": new_connection["ssid"], "reason": cls._last_connect_failure})
+        if cls._scan_failed:
+            yield False
+            return
+
+        yield cls._finish_setup(attempted, connected, failures)
+
+    @classmethod
+    def _load_network_config(cls) -> bool:
+        """Load the config and bring up the station interface, False if there is no usable config"""
+        # now see our prioritised list of networks and find the first available network
+        try:
+            config = cls.load_config()
+            cls.preferred_networks = config['known_networks']
+            cls.ap_config = config["access_point"]
+
+            # Check for config server settings
+            if "config_server" in config:
+                server_config = config["config_server"]
+                if server_config.get("enabled", False):
+                    password = server_config.get("password", "micropython")
+                    cls._config_server_max_clients = server_config.get("max_clients", 2)
+                    cls.start_config_server(password)
+
+            cls.scan_cache_ttl_ms = config.get("scan_cache", {}).get("ttl_ms", cls.scan_cache_ttl_ms)
+            cls.watch_interval_ms = config.get("watcher", {}).get("interval_ms", cls.watch_interval_ms)
+
+            timeouts = dict(cls._connect_timeout_defaults)
+            timeouts.update(config.get("connect_timeout", {}))
+            cls._connect_timeout = timeouts
+
+            roaming = dict(cls._roaming_defaults)
+            roaming.update(config.get("roaming", {}))
+            cls._roaming = roaming
+
+            retry = dict(cls._retry_defaults)
+            retry.update(config.get("retry", {}))
+            cls._retry = retry
+
+            if config.get("schema", 0) != 2:
+                log.warning("Did not get expected schema [2] in JSON config.")
         except Exception as e:
             log.error("Failed to load config file: {}. No known networks selected".format(e))
             cls.preferred_networks = []
@@ -204,63 +527,216 @@ loadConfig();
         # set things up
         cls.webrepl_triggered = False  # Until something wants it
         cls.wlan().active(True)
+        return True
+
+    @classmethod
+    def _candidates(cls):
+        """Yield connection candidates: the last-good network without scanning first, then scan and rank"""
+        cls._scan_failed = False
+        fast = cls._fast_reconnect_candidate()
+        if fast:
+            yield fast
 
         # scan what's available
-        available_networks = []
         try:
-            scan_results = cls.wlan().scan()
-            for network in scan_results:
-                try:
-                    ssid = network[0].decode("utf-8")
-                    bssid = network[1]
-                    strength = network[3]
-                    available_networks.append(dict(ssid=ssid, bssid=bssid, strength=strength))
-                except (IndexError, UnicodeDecodeError) as e:
-                    log.warning("Failed to parse network scan result: {}".format(e))
-                    continue
+            scan_results = cls.scan()
         except OSError as e:
             log.error("Network scan failed: {}".format(e))
-            return False
-        # Sort fields by strongest first in case of multiple SSID access points
-        available_networks.sort(key=lambda station: station["strength"], reverse=True)
-
-        # Get the ranked list of BSSIDs to connect to, ranked by preference and strength amongst duplicate SSID
-        candidates = []
-        for aPreference in cls.preferred_networks:
-            for aNetwork in available_networks:
-                if aPreference["ssid"] == aNetwork["ssid"]:
-                    connection_data = {
-                        "ssid": aNetwork["ssid"],
-                        "bssid": aNetwork["bssid"],  # NB: One day we might allow collection by exact BSSID
-                        "password": aPreference["password"],
-                        "enables_webrepl": aPreference["enables_webrepl"]}
-                    candidates.append(connection_data)
+            cls._scan_failed = True
+            return
+        ranked_rows = cls._ranked_rows(scan_results)
 
-        connected = False
-        for new_connection in candidates:
-            log.info("Attempting to connect to network {0}...".format(new_connection["ssid"]))
-            # Micropython 1.9.3+ supports BSSID specification so let's use that
-            if cls.connect_to(ssid=new_connection["ssid"], password=new_connection["password"],
-                              bssid=new_connection["bssid"]):
-                log.info("Successfully connected {0}".format(new_connection["ssid"]))
-                cls.webrepl_triggered = new_connection["enables_webrepl"]
-                
-                # Notify successful connection
-                try:
-                    ifconfig = cls.wlan().ifconfig()
-                    ip = ifconfig[0] if ifconfig else "unknown"
-                    cls._notify_connection_change("connected", ssid=new_connection["ssid"], ip=ip)
-                except Exception as e:
-                    log.warning(f"Failed to notify connection: {e}")
-                
-                connected = True
-                break  # We are connected so don't try more
-        
+        # Candidates in preference order; each SSID at every BSSID seen for it, best first
+        for ssid_key, aPreference in cls._known_order:
+            for row in ranked_rows.get(ssid_key, ()):
+                if fast and fast["ssid"] == aPreference["ssid"] and fast["bssid"] == row[1]:
+                    continue  # Already tried without scanning
+                yield {
+                    "ssid": aPreference["ssid"],
+                    "bssid": row[1],
+                    "channel": row[2],
+                    "password": aPreference.get("password", ""),
+                    "enables_webrepl": aPreference.get("enables_webrepl", False)}
+
+    @classmethod
+    def _known_networks_index(cls):
+        """SSID (as bytes, like scan rows) -> (known network entry, pinned BSSID, preferred BSSIDs)
+
+        Rebuilt only when the config changes.
+        """
+        if cls._known_source is not cls.preferred_networks:
+            order = []
+            index = {}
+            for aPreference in cls.preferred_networks:
+                ssid_key = aPreference["ssid"].encode()
+                if ssid_key not in index:  # The first (most preferred) entry wins
+                    pinned = cls._parse_bssid(aPreference.get("bssid"))
+                    ranked = [cls._parse_bssid(b) for b in aPreference.get("bssid_preference", ())]
+                    index[ssid_key] = (aPreference, pinned, [b for b in ranked if b])
+                    order.append((ssid_key, aPreference))
+            cls._known_order = order
+            cls._known_index = index
+            cls._known_source = cls.preferred_networks
+        return cls._known_index
+
+    @staticmethod
+    def _parse_bssid(text):
+        """'aa:bb:cc:dd:ee:ff' (or without separators) -> 6 bytes, None if absent or malformed"""
+        if not text:
+            return None
+        try:
+            bssid = binascii.unhexlify(text.replace(":", "").replace("-", ""))
+            if len(bssid) == 6:
+                return bssid
+        except (ValueError, TypeError):
+            pass
+        log.warning("Ignoring malformed BSSID: {}".format(text))
+        return None
+
+    @classmethod
+    def _ranked_rows(cls, scan_results) -> dict:
+        """One pass over the raw scan rows: known SSID (bytes) -> its rows, best first
+
+        Only the pinned BSSID if there is one, else ordered by bssid_preference, then strongest first.
+        """
+        index = cls._known_networks_index()
+        grouped = {}
+        for row in scan_results:
+            try:
+                entry = index.get(row[0])
+                if entry is None:
+                    continue
+                pinned, ranked = entry[1], entry[2]
+                if pinned is not None and row[1] != pinned:
+                    continue
+                grouped.setdefault(row[0], []).append((cls._bssid_rank(ranked, row[1]), -row[3], row))
+            except (IndexError, TypeError) as e:
+                log.warning("Failed to parse network scan result: {}".format(e))
+        for ssid_key, rows in grouped.items():
+            rows.sort(key=lambda ranked_row: ranked_row[:2])  # Stable, so ties keep scan order
+            grouped[ssid_key] = [ranked_row[2] for ranked_row in rows]
+        return grouped
+
+    @classmethod
+    def _best_rows(cls, scan_results) -> dict:
+        """Known SSID (bytes) -> its best row, see _ranked_rows"""
+        return {ssid_key: rows[0] for ssid_key, rows in cls._ranked_rows(scan_results).items()}
+
+    @staticmethod
+    def _bssid_rank(ranked, bssid) -> int:
+        for position, preferred in enumerate(ranked):
+            if preferred == bssid:
+                return position
+        return len(ranked)
+
+    @classmethod
+    def scan(cls, max_age_ms=None):
+        """Return wlan().scan() rows, reusing the last scan if younger than max_age_ms (default scan_cache_ttl_ms)
+
+        Raises OSError if a fresh scan is needed and fails.
+        """
+        cached = cls.last_scan(cls.scan_cache_ttl_ms if max_age_ms is None else max_age_ms)
+        if cached is not None:
+            return cached
+        results = cls.wlan().scan()
+        cls._scan_results = results
+        cls._scan_time = ticks_ms()
+        return results
+
+    @classmethod
+    def last_scan(cls, max_age_ms=None):
+        """The cached wlan().scan() rows if younger than max_age_ms (any age if None), without scanning
+
+        Returns None when there is no (fresh enough) scan.
+        """
+        if cls._scan_results is None:
+            return None
+        if max_age_ms is not None and ticks_diff(ticks_ms(), cls._scan_time) >= max_age_ms:
+            return None
+        return cls._scan_results
+
+    @classmethod
+    def invalidate_scan_cache(cls):
+        cls._scan_results = None
+
+    @classmethod
+    def _fast_reconnect_candidate(cls):
+        """The last network we successfully joined, if it is still a known network"""
+        last_good = cls._load_last_good()
+        if not last_good:
+            return None
+        entry = cls._known_networks_index().get(last_good["ssid"].encode())
+        if entry is None or (entry[1] is not None and entry[1] != last_good["bssid"]):
+            return None  # No longer known, or now pinned to another BSSID
+        if entry[2] and entry[2][0] != last_good["bssid"]:
+            return None  # bssid_preference ranks another BSSID first, so scan for it
+        aPreference = entry[0]
+        channel = last_good.get("channel")
+        if channel:
+            try:
+                cls.wlan().config(channel=channel)  # Not every port lets the station pick a channel
+            except (OSError, ValueError, TypeError):
+                pass
+        log.debug("Trying last good network {} without scanning".format(last_good["ssid"]))
+        return {
+            "ssid": last_good["ssid"],
+            "bssid": last_good["bssid"],
+            "channel": channel,
+            "password": aPreference.get("password", ""),
+            "enables_webrepl": aPreference.get("enables_webrepl", False)}
+
+    @classmethod
+    def _load_last_good(cls):
+        if not cls._last_good_loaded:
+            cls._last_good_loaded = True
+            try:
+                with open(cls.state_file, "r") as f:
+                    state = json.loads(f.read())
+                cls._last_good = {"ssid": state["ssid"], "bssid": binascii.unhexlify(state["bssid"]),
+                                  "channel": state.get("channel")}
+            except (OSError, ValueError, KeyError, TypeError):
+                cls._last_good = None
+        return cls._last_good
+
+    @classmethod
+    def _remember_last_good(cls, new_connection):
+        """Persist the network we just joined, only touching flash when it changed"""
+        last_good = {"ssid": new_connection["ssid"], "bssid": new_connection["bssid"],
+                     "channel": new_connection.get("channel")}
+        if last_good == cls._load_last_good() or last_good["bssid"] is None:
+            return
+        try:
+            cls._write_file_atomic(cls.state_file, json.dumps({
+                "ssid": last_good["ssid"],
+                "bssid": binascii.hexlify(last_good["bssid"]).decode(),
+                "channel": last_good["channel"]}))
+            cls._last_good = last_good
+        except OSError as e:
+            log.warning("Failed to save last good network: {}".format(e))
+
+    @classmethod
+    def _on_connected(cls, new_connection):
+        log.info("Successfully connected {0}".format(new_connection["ssid"]))
+        cls.webrepl_triggered = new_connection["enables_webrepl"]
+        cls._current_connection = new_connection
+        cls._weak_signal_ticks = 0
+        cls._remember_last_good(new_connection)
+
+        # Notify successful connection
+        try:
+            ifconfig = cls.wlan().ifconfig()
+            ip = ifconfig[0] if ifconfig else "unknown"
+            cls._notify_connection_change("connected", ssid=new_connection["ssid"], ip=ip)
+        except Exception as e:
+            log.warning(f"Failed to notify connection: {e}")
+
+    @classmethod
+    def _finish_setup(cls, attempted, connected, failures) -> bool:
         # If no connection was successful and we have candidates, notify failure
-        if not connected and candidates:
+        if not connected and attempted:
             try:
-                failed_ssids = [c["ssid"] for c in candidates]
-                cls._notify_connection_change("connection_failed", attempted_networks=failed_ssids)
+                cls._notify_connection_change("connection_failed", attempted_networks=attempted,
+                                              failures=failures)
             except Exception as e:
                 log.warning(f"Failed to notify connection failure: {e}")
 
@@ -269,240 +745,272 @@ loadConfig();
         cls._ap_start_policy = cls.ap_config.get("start_policy", "never")
         should_start_ap = cls.wants_accesspoint()
         try:
-            cls.accesspoint().active(should_start_ap)
-            if should_start_ap:  # Only bother setting the config if it WILL be active
-                log.info("Enabling your access point...")
-                cls.accesspoint().config(**cls.ap_config["config"])
-                cls.webrepl_triggered = cls.ap_config["enables_webrepl"]
-                
-                # Notify AP started
-                try:
-                    essid = cls.ap_config["config"].get("essid", "unknown")
-                    cls._notify_connection_change("ap_started", essid=essid)
-                except Exception as e:
-                    log.warning(f"Failed to notify AP start: {e}")
-                    
-            cls.accesspoint().active(cls.wants_accesspoint())  # It may be DEACTIVATED here
+            ap = cls.accesspoint()
+            # Only touch the radio on a real change: each reconfigure resets the soft-AP and drops its clients
+            is_active = ap.active()
+            if should_start_ap:
+                ap_config = cls.ap_config["config"]
+                if not is_active:
+                    log.info("Enabling your access point...")
+                    ap.active(True)
+                if not is_active or ap_config != cls._ap_applied_config:
+                    ap.config(**ap_config)
+                    cls._ap_applied_config = dict(ap_config)  # A copy, as config edits mutate the cached dict
+                cls.webrepl_triggered = cls.webrepl_triggered or cls.ap_config["enables_webrepl"]
+
+                if not is_active:
+                    try:
+                        essid = ap_config.get("essid", "unknown")
+                        cls._notify_connection_change("ap_started", essid=essid)
+                    except Exception as e:
+                        log.warning(f"Failed to notify AP start: {e}")
+            elif is_active:
+                log.info("Disabling your access point...")
+                ap.active(False)
+                cls._ap_applied_config = None
         except OSError as e:
             log.error("Failed to configure access point: {}".format(e))
 
         # may need to reload the config if access points trigger it
 
-        # start the webrepl according to the rules
-        if cls.webrepl_triggered:
-            try:
-                webrepl.start()
-            except (NameError, TypeError) as e:
-                log.warning(f"Could not start WebREPL: {e}")
+        # start or stop the webrepl according to the rules
+        cls._apply_webrepl(cls.webrepl_triggered)
 
         # return the success status, which is ultimately if we connected to managed and not ad hoc wifi.
         return cls.wlan().isconnected()
 
+    @classmethod
+    def _apply_webrepl(cls, wanted):
+        """Start or stop WebREPL only on a change, reporting webrepl_started / webrepl_stopped"""
+        if wanted == cls._webrepl_active:
+            return
+        try:
+            if wanted:
+                webrepl.start()
+            else:
+                webrepl.stop()
+        except (NameError, TypeError, AttributeError, OSError) as e:
+            log.warning(f"Could not {'start' if wanted else 'stop'} WebREPL: {e}")
+            return
+        cls._webrepl_active = wanted
+        cls._notify_connection_change("webrepl_started" if wanted else "webrepl_stopped")
+
+    @classmethod
+    async def _consider_roaming(cls):
+        """While connected, move to a clearly stronger BSSID of the same SSID after a run of weak-signal ticks"""
+        settings = cls._roaming
+        current = cls._current_connection
+        if not settings["enabled"] or current is None:
+            return
+        try:
+            rssi = cls.wlan().status("rssi")
+        except (OSError, TypeError, ValueError):
+            return  # Port cannot report RSSI
+        if rssi >= settings["rssi_threshold"]:
+            cls._weak_signal_ticks = 0
+            return
+        cls._weak_signal_ticks += 1
+        if cls._weak_signal_ticks < settings["low_ticks"]:
+            return
+        cls._weak_signal_ticks = 0
+
+        try:
+            scan_results = cls.scan(max_age_ms=settings["scan_max_age_ms"])  # Each scan stalls the loop
+        except OSError as e:
+            log.warning("Roaming scan failed: {}".format(e))
+            return
+        row = cls._best_rows(scan_results).get(current["ssid"].encode())
+        if row is None or row[1] == current["bssid"] or row[3] - rssi < settings["hysteresis_db"]:
+            return
+
+        async with cls._network_lock():
+            if cls._current_connection is not current:
+                return  # A setup pass reconnected while we waited
+            log.info("Roaming {} from {} dBm to {} dBm".format(current["ssid"], rssi, row[3]))
+            target = dict(current)
+            target["bssid"] = row[1]
+            target["channel"] = row[2]
+            if not await cls.connect_to_async(ssid=target["ssid"], password=target["password"], bssid=target["bssid"]):
+                log.warning("Roaming to {} failed: {}".format(target["ssid"], cls._last_connect_failure))
+                cls.invalidate_scan_cache()  # Its view of that access point was wrong or stale
+                if not await cls.connect_to_async(ssid=current["ssid"], password=current["password"],
+                                                  bssid=current["bssid"]):
+                    log.warning("Reconnecting to the previous access point failed: {}".format(
+                        cls._last_connect_failure))
+                    if cls._link_lost is not None:
+                        cls._link_lost.set()  # Have manage() set the network up again straight away
+                return
+        cls._current_connection = target
+        cls._remember_last_good(target)
+        try:
+            cls._notify_connection_change("roamed", ssid=target["ssid"],
+                                          bssid=binascii.hexlify(target["bssid"]).decode(),
+                                          previous_bssid=binascii.hexlify(current["bssid"]).decode(),
+                                          rssi=row[3], previous_rssi=rssi)
+        except Exception as e:
+            log.warning(f"Failed to notify roaming: {e}")
+
     @classmethod
     def connect_to(cls, *, ssid, password, **kwargs) -> bool:
+        if not cls._begin_connect(ssid, password, **kwargs):
+            return False
+
+        check = 0
+        while True:  # Until connected, failed, or the learned timeout for this network expires
+            result = cls._poll_connect(ssid, check)
+            if result is not None:
+                return result
+            time.sleep_ms(cls._connect_poll_ms)
+            check += 1
+
+    @classmethod
+    async def connect_to_async(cls, *, ssid, password, **kwargs) -> bool:
+        """Same as connect_to(), but awaits between polls instead of blocking the event loop"""
+        if not cls._begin_connect(ssid, password, **kwargs):
+            return False
+
+        check = 0
+        while True:
+            result = cls._poll_connect(ssid, check)
+            if result is not None:
+                return result
+            await asyncio.sleep_ms(cls._connect_poll_ms)
+            check += 1
+
+    @classmethod
+    def _begin_connect(cls, ssid, password, **kwargs) -> bool:
+        cls._last_connect_failure = None
+        cls._connect_bssid = kwargs.get("bssid")
+        cls._connect_deadline_ms = cls.connect_timeout_ms(ssid, cls._connect_bssid)
+        cls._connect_started = ticks_ms()
         try:
             cls.wlan().connect(ssid, password, **kwargs)
         except OSError as e:
             log.error("Failed to initiate connection to {}: {}".format(ssid, e))
+            cls._last_connect_failure = "connect_error"
             return False
+        return True
 
-        for check in range(0, 10):  # Wait a maximum of 10 times (10 * 500ms = 5 seconds) for success
-            try:
-                if cls.wlan().isconnected():
-                    return True
-            except OSError as e:
-                log.warning("Connection check failed for {}: {}".format(ssid, e))
-                break
-            time.sleep_ms(500)
-        return False
-
-    @classmethod
-    def _check_basic_auth(cls, request):
-        """Check HTTP Basic Authentication"""
-        if not cls._config_server_password:
-            return True  # No password required
-            
-        auth_header = None
-        for line in request.split('\r\n'):
-            if line.lower().startswith('authorization: basic '):
-                auth_header = line.split(' ', 2)[2]
-                break
-        
-        if not auth_header:
-            return False
-            
+    @classmethod
+    def _poll_connect(cls, ssid, check):
+        """One connection check: True when connected, False to give up, None to keep waiting"""
         try:
-            # Decode base64 credentials
-            import ubinascii
-            decoded = ubinascii.a2b_base64(auth_header).decode()
-            if ':' in decoded:
-                username, password = decoded.split(':', 1)
-                return username == "admin" and password == cls._config_server_password
-        except:
-            pass
-        return False
+            if cls.wlan().isconnected():
+                cls._record_association(ssid, cls._connect_bssid, ticks_diff(ticks_ms(), cls._connect_started))
+                cls._timeout_streaks.pop((ssid, cls._connect_bssid), None)
+                return True
+            # The first check straight after connect() may still report the previous attempt's status
+            if check > 0:
+                reason = cls._connect_failure_reason(cls.wlan().status())
+                if reason:
+                    log.warning("Connection to {} failed: {}".format(ssid, reason))
+                    cls._last_connect_failure = reason
+                    return False
+        except OSError as e:
+            log.warning("Connection check failed for {}: {}".format(ssid, e))
+            cls._last_connect_failure = "check_error"
+            return False
+        if ticks_diff(ticks_ms(), cls._connect_started) >= cls._connect_deadline_ms:
+            cls._last_connect_failure = "timeout"
+            key = (ssid, cls._connect_bssid)
+            cls._timeout_streaks[key] = cls._timeout_streaks.get(key, 0) + 1
+            return False
+        return None
 
     @classmethod
-    def _handle_config_request(cls, request: str) -> str:
-        """
-        Handle HTTP requests for the configuration web server.
-        Supports:
-          - GET /config       → returns JSON config
-          - POST /config      → updates JSON config
-          - GET / or /index   → returns HTML editor
-        Requires Basic Auth username “admin” and password cls._config_server_password,
-        unless password is None or empty (in which case auth is skipped).
+    def connect_timeout_ms(cls, ssid, bssid=None) -> int:
+        """How long to wait for an association: p95 of past successes plus a margin, within the floor/ceiling
+
+        Doubled for each consecutive timeout on this SSID/BSSID (up to the ceiling) until one succeeds.
         """
-        # 1) Authentication
-        if cls._config_server_password:
-            # look for “Authorization: Basic …”
-            auth = None
-            for line in request.split('\r\n'):
-                if line.lower().startswith("authorization: basic "):
-                    auth = line.split(" ", 2)[2]
-                    break
-            if not auth:
-                return (
-                    "HTTP/1.1 401 Unauthorized\r\n"
-                    "WWW-Authenticate: Basic realm=\"WiFi Config\"\r\n"
-                    "Content-Type: text/plain\r\n"
-                    "\r\n"
-                    "Authentication required"
-                )
-            # decode and verify
-            try:
-                import ubinascii
-                user_pass = ubinascii.a2b_base64(auth).decode()
-                user, pwd = user_pass.split(":", 1)
-                if user != "admin" or pwd != cls._config_server_password:
-                    raise ValueError
-            except Exception:
-                return (
-                    "HTTP/1.1 401 Unauthorized\r\n"
-                    "WWW-Authenticate: Basic realm=\"WiFi Config\"\r\n"
-                    "Content-Type: text/plain\r\n"
-                    "\r\n"
-                    "Invalid credentials"
-                )
-
-        # 2) POST /config → update config
-        if request.startswith("POST /config"):
-            # extract body
-            idx = request.find("\r\n\r\n")
-            if idx < 0:
-                return "HTTP/1.1 400 Bad Request\r\nContent-Type: text/plain\r\n\r\nNo request body"
-            body = request[idx+4:]
-            # parse JSON
-            try:
-                import json
-                cfg = json.loads(body)
-                if "known_networks" not in cfg or "access_point" not in cfg:
-                    raise ValueError("Missing required keys")
-            except ValueError as ve:
-                return (
-                    "HTTP/1.1 400 Bad Request\r\n"
-                    "Content-Type: text/plain\r\n"
-                    f"\r\nInvalid JSON: {ve}"
-                )
-            except Exception as e:
-                return (
-                    "HTTP/1.1 400 Bad Request\r\n"
-                    "Content-Type: text/plain\r\n"
-                    f"\r\nJSON parse error: {e}"
-                )
-            # write file
-            try:
-                with open(cls.config_file, "w") as f:
-                    f.write(body)
-                log.info("Configuration updated via web interface")
-                # reconfigure network immediately
-                try:
-                    cls.setup_network()
-                except Exception as e:
-                    log.warning(f"Network re-setup failed: {e}")
-                return "HTTP/1.1 200 OK\r\nContent-Type: text/plain\r\n\r\nConfiguration updated successfully"
-            except Exception as e:
-                return (
-                    "HTTP/1.1 500 Internal Server Error\r\n"
-                    "Content-Type: text/plain\r\n"
-                    f"\r\nFailed to save config: {e}"
-                )
-
-        # 3) GET /config → serve JSON
-        if request.startswith("GET /config"):
+        settings = cls._connect_timeout
+        samples = cls._association_history.get((ssid, bssid)) or cls._association_history.get((ssid, None))
+        if samples:
+            ordered = sorted(samples)
+            p95 = ordered[(len(ordered) * 95 + 99) // 100 - 1]
+            timeout = min(max(p95 + settings["margin_ms"], settings["floor_ms"]), settings["ceiling_ms"])
+        else:
+            timeout = settings["default_ms"]
+        streak = cls._timeout_streaks.get((ssid, bssid), 0)
+        if streak:
+            timeout = max(timeout, min(timeout << min(streak, 8), settings["ceiling_ms"]))
+        return timeout
+
+    @classmethod
+    def _record_association(cls, ssid, bssid, elapsed_ms):
+        keys = ((ssid, None),) if bssid is None else ((ssid, bssid), (ssid, None))
+        for key in keys:
+            samples = cls._association_history.setdefault(key, [])
+            samples.append(elapsed_ms)
+            if len(samples) > cls._association_samples:
+                samples.pop(0)
+
+    @classmethod
+    def _connect_failure_reason(cls, status):
+        """Map a terminal wlan().status() code to a reason such as 'wrong_password', else None"""
+        if cls._terminal_statuses is None:
+            cls._terminal_statuses = {getattr(network, name): name[5:].lower()
+                                      for name in cls._terminal_status_names if hasattr(network, name)}
+        return cls._terminal_statuses.get(status)
+
+    @classmethod
+    def _config_server_module(cls):
+        """The config_server submodule, imported on first use so the core never loads it"""
+        if cls._server_module is None:
             try:
-                with open(cls.config_file, "r") as f:
-                    data = f.read()
-                return (
-                    "HTTP/1.1 200 OK\r\n"
-                    "Content-Type: application/json\r\n"
-                    "\r\n"
-                    f"{data}"
-                )
-            except Exception as e:
-                return (
-                    "HTTP/1.1 500 Internal Server Error\r\n"
-                    "Content-Type: text/plain\r\n"
-                    f"\r\nCould not read config: {e}"
-                )
-
-        # 4) GET / or /index → serve HTML editor
-        if request.startswith("GET / ") or "GET /index" in request:
-            return (
-                "HTTP/1.1 200 OK\r\n"
-                "Content-Type: text/html\r\n"
-                "\r\n"
-                f"{cls._config_html}"
-            )
-
-        # 5) anything else → 404
-        return (
-            "HTTP/1.1 404 Not Found\r\n"
-            "Content-Type: text/plain\r\n"
-            "\r\n"
-            "Not found"
-        )
-
-    @classmethod
-    async def _run_config_server(cls):
-        """Run the configuration web server"""
+                from . import config_server
+            except ImportError:  # Installed as flat modules
+                import config_server
+            cls._server_module = config_server
+        return cls._server_module
+
+    @classmethod
+    def _handle_config_request(cls, request, body=None):
+        """Build the response to one config server request; see config_server.handle_request"""
+        return cls._config_server_module().handle_request(cls, request, body)
+
+    @classmethod
+    def _schedule_reconfigure(cls):
+        """Re-run network setup shortly, after the response to the client has been sent"""
+        cls._apply_status = {"state": "pending"}
+        cls._apply_requested = True
+        if not asyncio:
+            cls._reconfigure_now_sync()
+            return
+        if cls._apply_running:
+            return  # The running task picks up the newer config before it finishes
+        cls._apply_running = True
+        asyncio.get_event_loop().create_task(cls._reconfigure_later())
+
+    @classmethod
+    def _reconfigure_now_sync(cls):
+        """Fallback for builds without asyncio: apply before responding"""
+        cls._apply_requested = False
+        cls._apply_status = {"state": "applying"}
         try:
-            import socket
-            server_socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-            server_socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
-            server_socket.bind(('0.0.0.0', 8080))
-            server_socket.listen(1)
-            server_socket.settimeout(1.0)  # Non-blocking with timeout
-            
-            log.info("Config server started on port 8080")
-            
-            while cls._config_server_enabled:
+            cls._apply_status = {"state": "done", "connected": cls.setup_network()}
+        except Exception as e:
+            log.warning(f"Network re-setup failed: {e}")
+            cls._apply_status = {"state": "failed", "error": str(e)}
+
+    @classmethod
+    async def _reconfigure_later(cls):
+        """Apply saved config changes; POSTs arriving meanwhile are coalesced into one more pass"""
+        try:
+            while cls._apply_requested:
+                await asyncio.sleep_ms(cls._apply_grace_ms)
+                cls._apply_requested = False
+                cls._apply_status = {"state": "applying"}
                 try:
-                    conn, addr = server_socket.accept()
-                    log.debug(f"Config server connection from {addr}")
-                    
-                    # Read request with timeout
-                    conn.settimeout(5.0)
-                    request = conn.recv(4096).decode()
-                    
-                    # Handle request
-                    response = cls._handle_config_request(request)
-                    
-                    # Send response
-                    conn.send(response.encode())
-                    conn.close()
-                    
-                except OSError:
-                    # Timeout or no connection - yield control
-                    await asyncio.sleep_ms(100)
+                    connected = await cls.setup_network_async()
+                    cls._apply_status = {"state": "done", "connected": connected}
                 except Exception as e:
-                    log.warning(f"Config server request error: {e}")
-                    
-            server_socket.close()
-            log.info("Config server stopped")
-            
-        except Exception as e:
-            log.error(f"Config server failed to start: {e}")
+                    log.warning(f"Network re-setup failed: {e}")
+                    cls._apply_status = {"state": "failed", "error": str(e)}
+                if cls._apply_requested:
+                    cls._apply_status = {"state": "pending"}
+        finally:
+            cls._apply_running = False
 
     @classmethod
     def start_config_server(cls, password="micropython"):
@@ -512,29 +1020,41 @@ loadConfig();
             return False
             
         cls._config_server_password = password
+        if cls._config_server_enabled:
+            return True  # Already serving; setup_network() calls us on every pass
         cls._config_server_enabled = True
         
         # Start server as async task
         loop = asyncio.get_event_loop()
-        loop.create_task(cls._run_config_server())
+        loop.create_task(cls._config_server_module().run(cls))
         
-        log.info("Config server starting on http://[device-ip]:8080")
+        log.info("Config server starting on http://[device-ip]:{}".format(cls.config_server_port))
         return True
 
     @classmethod
     def stop_config_server(cls):
         """Stop the configuration web server"""
         cls._config_server_enabled = False
+        if cls._config_server is not None:
+            cls._config_server.close()
+            cls._config_server = None
+            log.info("Config server stopped")
 
     @classmethod
     def on_connection_change(cls, callback):
         """Register a callback function for connection state changes
         
-        Callback will be called with (event, **kwargs) where event is one of:
+        Callback will be called with (event, **kwargs), and may be an async def function,
+        where event is one of:
         - 'connected': Successfully connected to a network
         - 'disconnected': Lost connection to network  
         - 'ap_started': Access point was activated
-        - 'connection_failed': All connection attempts failed
+        - 'webrepl_started' / 'webrepl_stopped': WebREPL was started or stopped
+        - 'roamed': Moved to a stronger access point of the same SSID (kwargs ssid, bssid,
+          previous_bssid, rssi, previous_rssi)
+        - 'connection_failed': All connection attempts failed (kwargs attempted_networks, and
+          failures: a list of {'ssid', 'reason'} where reason is e.g. 'wrong_password',
+          'no_ap_found' or 'timeout')
         
         Example:
             def my_callback(event, **kwargs):
@@ -554,39 +1074,125 @@ loadConfig();
         """Remove a previously registered connection callback"""
         if callback in cls._connection_callbacks:
             cls._connection_callbacks.remove(callback)
+            cls._callback_stats.pop(callback, None)
             log.debug(f"Removed connection callback: {callback}")
 
     @classmethod
     def _notify_connection_change(cls, event, **kwargs):
-        """Notify all registered callbacks of a connection state change"""
+        """Notify all registered callbacks of a connection state change
+
+        In "sync" dispatch_mode callbacks run inline; in "async" mode the event is queued
+        and this returns at once.
+        """
         log.debug(f"Connection event: {event} with args: {kwargs}")
-        
+
+        # Update last known state for state change detection, even before callbacks have run
+        if event not in cls._informational_events:
+            cls._last_connection_state = event
+
+        if cls.dispatch_mode == "async" and asyncio:
+            cls._queue_event(event, kwargs)
+            return
         for callback in cls._connection_callbacks:
+            start = ticks_ms()
             try:
-                callback(event, **kwargs)
+                result = callback(event, **kwargs)
+                if asyncio and hasattr(result, "send"):
+                    asyncio.get_event_loop().create_task(result)  # async def callback
             except Exception as e:
                 log.warning(f"Connection callback error: {e}")
-        
-        # Update last known state for state change detection
-        cls._last_connection_state = event
+                cls._record_callback(callback, start, True)
+            else:
+                cls._record_callback(callback, start, False)
+
+    @classmethod
+    def _queue_event(cls, event, kwargs):
+        """Add an event to the ring queue, applying event_overflow when it is full"""
+        size = cls.event_queue_size
+        if cls._event_queue is None:
+            cls._event_queue = [None] * size
+            cls._event_signal = asyncio.Event()
+            asyncio.get_event_loop().create_task(cls._run_event_dispatcher())
+        queue = cls._event_queue
+        if cls._event_count == size:
+            cls.events_dropped += 1
+            if cls.event_overflow == "coalesce":
+                # Replace the newest queued event of the same kind, keeping the queue order
+                for i in range(cls._event_count - 1, -1, -1):
+                    slot = (cls._event_head + i) % size
+                    if queue[slot][0] == event:
+                        queue[slot] = (event, kwargs)
+                        return
+            cls._event_head = (cls._event_head + 1) % size  # Drop the oldest
+            cls._event_count -= 1
+        queue[(cls._event_head + cls._event_count) % size] = (event, kwargs)
+        cls._event_count += 1
+        cls._event_signal.set()
+
+    @classmethod
+    async def _run_event_dispatcher(cls):
+        """Drain the event queue, awaiting async callbacks, and sleep until more events arrive"""
+        while True:
+            while cls._event_count:
+                queue = cls._event_queue
+                event, kwargs = queue[cls._event_head]
+                queue[cls._event_head] = None
+                cls._event_head = (cls._event_head + 1) % len(queue)
+                cls._event_count -= 1
+                for callback in cls._connection_callbacks:
+                    start = ticks_ms()
+                    try:
+                        result = callback(event, **kwargs)
+                        if hasattr(result, "send"):
+                            await result
+                    except Exception as e:
+                        log.warning(f"Connection callback error: {e}")
+                        cls._record_callback(callback, start, True)
+                    else:
+                        cls._record_callback(callback, start, False)
+                await asyncio.sleep_ms(0)  # Let the reconnect logic run between events
+            cls._event_signal.clear()
+            await cls._event_signal.wait()
+
+    @classmethod
+    def _record_callback(cls, callback, start, failed):
+        elapsed = ticks_diff(ticks_ms(), start)
+        stats = cls._callback_stats.get(callback)
+        if stats is None:
+            stats = cls._callback_stats[callback] = [0, 0, 0, 0]
+        stats[0] += 1
+        stats[1] += elapsed
+        stats[2] = max(stats[2], elapsed)
+        stats[3] += failed
+
+    @classmethod
+    def callback_stats(cls):
+        """Per-callback timing, keyed by callback name: calls, total_ms, max_ms and errors
+
+        In "sync" mode an async def callback is only timed up to creating its task.
+        """
+        return {getattr(callback, "__name__", str(callback)):
+                    {"calls": stats[0], "total_ms": stats[1], "max_ms": stats[2], "errors": stats[3]}
+                for callback, stats in cls._callback_stats.items()}
 
     @classmethod
     def _check_and_notify_connection_state(cls):
         """Check current connection state and notify if changed"""
         try:
-            is_connected = cls.wlan().isconnected()
+            wlan = cls.wlan()
+            is_connected = wlan.isconnected()
             current_state = "connected" if is_connected else "disconnected"
             
             # Only notify on state changes
             if cls._last_connection_state != current_state:
                 if is_connected:
                     # Get connection details
-                    ifconfig = cls.wlan().ifconfig()
+                    ifconfig = wlan.ifconfig()
                     ip = ifconfig[0] if ifconfig else "unknown"
                     # Try to get connected SSID (not all MicroPython versions support this)
                     ssid = "unknown"
                     try:
-                        config = cls.wlan().config('ssid')
+                        config = wlan.config('ssid')
                         if config:
                             ssid = config
                     except: